@@ -2,7 +2,15 @@
 import sys
 import inspect
 import frame
+from itertools import islice, izip
+from array import array
+from collections import OrderedDict
+from operator import attrgetter
 from object import *
+from pvector import PVector, PRange
+from pmap import PMap
+from rope import Rope
+import vector
 from exception import *
 from interrupt import *
 
@@ -37,15 +45,36 @@ def print_string(s):
     sys.stdout.write(s)
     sys.stdout.flush()
 
+# types of the sequences ('get', 'set', 'len', 'slice')
+types_seq = ('str', 'list') + types_array
+
 def to_boolean(obj):
     if obj.type == 'int' and obj.value == 0:
         return False
     else:
         return True
 
+def run_codes(codes):
+    ''' Run the codes as statements. Return the value of the last one,
+    or the signal which stopped them.
+    '''
+    for c in codes:
+        obj = c.execute()
+
+        if obj.__class__ is Signal:
+            return obj
+
+    return obj
+
 def eval_recur(obj):
     if obj.type == 'list':
         return ListObject([eval_recur(item) for item in obj.value])
+    elif obj.type == 'dict':
+        get = obj.value.get
+        items = [(eval_recur(key), eval_recur(get(to_key(key))))
+                 for key in obj.keys]
+        return DictObject(PMap((to_key(key), value) for key, value in items),
+                          PVector(key for key, value in items))
     elif obj.type == 'code':
         return eval_recur(obj.evaluate())
     else:
@@ -60,17 +89,21 @@ def eval_recur(obj):
 # main entry
 
 def func_main(arg):
-    global called_main
-
     if called_main:
         raise Exception_base('\'main\' can\'t be called by the user.')
 
+    run_main(arg.evaluate().value)
+
+def run_main(codes):
+    ''' Run the top-level codes, as 'main'. (codes may be a generator,
+    for the codes of a file parsed while it runs)
+    '''
+    global called_main
     called_main = True
-    codes = arg.evaluate()
 
-    for c in codes.value:
+    for c in codes:
         try:
-            c.evaluate()
+            c.execute()
         except Interrupt_base:
             pass
 
@@ -143,7 +176,7 @@ def func_if(arg_1, arg_2):
         raise Exception_type('Second argument of \'if\' should be'\
                              ' \'list\', not \'%s\'.' % codes.type)
     if to_boolean(cond) and codes.value:
-        return [c.evaluate() for c in codes.value][-1]
+        return run_codes(codes.value)
 
 def func_if_else(arg_1, arg_2, arg_3):
     cond = arg_1.evaluate()
@@ -159,10 +192,10 @@ def func_if_else(arg_1, arg_2, arg_3):
 
     if to_boolean(cond):
         if codes_true.value:
-            return [c.evaluate() for c in codes_true.value][-1]
+            return run_codes(codes_true.value)
     else:
         if codes_false.value:
-            return [c.evaluate() for c in codes_false.value][-1]
+            return run_codes(codes_false.value)
 
 # -------------------------------
 # looping
@@ -175,31 +208,37 @@ def func_for(arg_1, arg_2, arg_3):
         raise Exception_type('First argument of \'for\' should be'\
                              ' \'name\', not \'%s\'.' % var.type)
 
-    if var_range.type != 'list':
+    if var_range.type not in types_range:
         raise Exception_type('Second argument of \'for\' should be'\
-                             ' \'list\', not \'%s\'.' % var_range.type)
+                             ' \'list\' or \'stream\', not \'%s\'.'\
+                             % var_range.type)
     
     if codes.type != 'list':
         raise Exception_type('Third argument of \'for\' should be'\
                              ' \'list\', not \'%s\'.' % codes.type)
 
-    for item in var_range.value:
-        status = 'normal'
+    for item in iter_seq(var_range):
         frame.assign_variable(var_name.value, item)
-        
-        for c in codes.value:    
-            try:
-                c.evaluate()
-            except Interrupt_loop as e:
-                status = e.status
+        try:
+            for c in codes.value:
+                obj = c.execute()
+
+                if obj.__class__ is Signal:
+                    break
+            else:
+                continue
+        except Interrupt_loop as e:
+            # 'break' or 'continue' inside an expression
+            if e.status == 'break':
                 break
 
-        if status == 'break':
-            break
-        elif status == 'continue':
             continue
-        else:
-            pass
+
+        # stopped by a signal
+        if obj is signal_break:
+            break
+        elif obj is not signal_continue:
+            return obj
 
 def func_while(arg_1, arg_2):
     codes = arg_2.evaluate()
@@ -209,24 +248,32 @@ def func_while(arg_1, arg_2):
                              ' \'list\', not \'%s\'.' % codes.type)
 
     while to_boolean(arg_1.evaluate()):
-        status = 'normal'
-        
-        for c in codes.value:
-            try:
-                c.evaluate()
-            except Interrupt_loop as e:
-                status = e.status
+        try:
+            for c in codes.value:
+                obj = c.execute()
+
+                if obj.__class__ is Signal:
+                    break
+            else:
+                continue
+        except Interrupt_loop as e:
+            # 'break' or 'continue' inside an expression
+            if e.status == 'break':
                 break
-        
-        if status == 'break':
-            break
-        elif status == 'continue':
+
             continue
-        else:
-            pass
+
+        # stopped by a signal
+        if obj is signal_break:
+            break
+        elif obj is not signal_continue:
+            return obj
 
 # -------------------------------
 # flow control
+# ... These raise the interrupts only when they are called inside
+# ... an expression; as statements they give signals instead.
+# ... (see CodeObject.execute)
 
 def func_return(arg):
     raise Interrupt_return(arg.evaluate())
@@ -247,7 +294,7 @@ def func_let(arg_1, arg_2):
         raise Exception_type('First argument of \'let\' should be'\
                              ' \'name\', not \'%s\'.' % name.type)
 
-    # assign obj.copy() instead of obj, to force passing by value
+    # (objects are immutable, so obj.copy() is obj itself : O(1))
     frame.assign_variable(name.value, obj.copy())
     return obj
 
@@ -265,7 +312,7 @@ def func_func(arg_1, arg_2):
         raise Exception_type('Second argument of \'func\' should be'\
                              ' \'list\', not \'%s\'.' % codes_raw.type)
 
-    params, codes = [], codes_raw.value
+    params, codes = [], list(codes_raw.value)
 
     for p_raw in params_raw.value:
         p = p_raw.evaluate()
@@ -293,18 +340,18 @@ def func_is_type(arg_1, arg_2):
                              ' \'str\', not \'%s\'.' % name.type)
 
     if name.value == 'any':
-        return IntObject(1)
+        return obj_true
 
     if obj.type == name.value:
-        return IntObject(1)
+        return obj_true
 
     if obj.type in ('int', 'float') and name.value == 'num':
-        return IntObject(1)
+        return obj_true
     
-    if obj.type in ('str', 'list') and name.value == 'seq':
-        return IntObject(1)
+    if obj.type in types_seq and name.value == 'seq':
+        return obj_true
 
-    return IntObject(0)
+    return obj_false
 
 # -------------------------------
 # type conversion
@@ -315,14 +362,14 @@ def func_to_int(arg):
     if obj.type == 'int':
         return obj.copy()
     elif obj.type == 'float':
-        return IntObject(int(obj.value))
+        return make_int(int(obj.value))
     elif obj.type == 'str':
         try:
             v = int(obj.value)
         except ValueError:
             raise Exception_type('Failed to convert the string \'%s\''\
                                  ' to integer.' % obj.value)
-        return IntObject(v)
+        return make_int(v)
     else:
         raise Exception_type('Can\'t convert \'%s\' to \'int\'.'\
                              % obj.type)
@@ -363,10 +410,83 @@ def func_to_list(arg):
         return ListObject([StrObject(c) for c in obj.value])
     elif obj.type == 'list':
         return obj.copy()
+    elif obj.type == 'stream' or obj.type in types_array:
+        return ListObject(PVector(iter_seq(obj)))
     else:
         raise Exception_type('Can\'t convert \'%s\' to \'list\'.'\
                              % obj.type)
 
+def func_int_array(arg):
+    return make_array(IntArrayObject, arg.evaluate())
+
+def func_float_array(arg):
+    return make_array(FloatArrayObject, arg.evaluate())
+
+def make_array(cls, obj):
+    ''' Return the array object (of the class) of the items of the
+    sequence, or of 'obj' zeros if it's an integer.
+    '''
+    if obj.type == 'int':
+        if obj.value < 0:
+            raise Exception_type('Argument of \'%s\' should be'\
+                                 ' nonnegative.' % cls.type)
+
+        return cls(array(cls.typecode, [0]) * obj.value)
+
+    if obj.type not in types_range:
+        raise Exception_type('Argument of \'%s\' should be \'int\','\
+                             ' \'list\' or \'stream\', not \'%s\'.'\
+                             % (cls.type, obj.type))
+
+    if obj.__class__ is cls:
+        return obj
+    elif obj.type in types_array:
+        return cls(obj.value)
+
+    rng = obj.value
+
+    if rng.__class__ is PRange:
+        # (made from the range, without the objects of the items)
+        start, diff = rng.start, rng.diff
+
+        try:
+            return cls(array(cls.typecode,
+                             xrange(start, start + rng.count * diff, diff)))
+        except OverflowError:
+            pass
+
+    objs = list(iter_items(obj))
+    types = set([item.type for item in objs])
+
+    for t in types:
+        check_item(cls, t)
+
+    try:
+        return cls(array(cls.typecode, [item.value for item in objs]))
+    except OverflowError:
+        raise_overflow()
+
+def to_item(cls, obj):
+    ''' Return the value of the object to store in an array object of the
+    class.
+    '''
+    check_item(cls, obj.type)
+
+    if cls.type == 'int_array' and \
+       not -sys.maxint - 1 <= obj.value <= sys.maxint:
+        raise_overflow()
+
+    return obj.value
+
+def check_item(cls, t):
+    if t != cls.type_item and not (t == 'int' and cls.type == 'float_array'):
+        raise Exception_type('Items of \'%s\' should be \'%s\', not'\
+                             ' \'%s\'.' % (cls.type, cls.type_item, t))
+
+def raise_overflow():
+    raise Exception_type('Items of \'int_array\' should be between'\
+                         ' %d and %d.' % (-sys.maxint - 1, sys.maxint))
+
 # -------------------------------
 # comparison
 
@@ -376,14 +496,14 @@ def func_geq(arg_1, arg_2):
     if (left.type in ('int', 'float') and
         right.type in ('int', 'float')):
         if left.value >= right.value:
-            return IntObject(1)
+            return obj_true
         else:
-            return IntObject(0)
+            return obj_false
     elif left.type == 'str' and right.type == 'str':
         if left.value >= right.value:
-            return IntObject(1)
+            return obj_true
         else:
-            return IntObject(0)
+            return obj_false
     else:
         raise Exception_type('Can\'t find whether \'%s\' >= \'%s\'.'\
                              % (left.type, right.type))
@@ -394,14 +514,14 @@ def func_gnq(arg_1, arg_2):
     if (left.type in ('int', 'float') and
         right.type in ('int', 'float')):
         if left.value > right.value:
-            return IntObject(1)
+            return obj_true
         else:
-            return IntObject(0)
+            return obj_false
     elif left.type == 'str' and right.type == 'str':
         if left.value > right.value:
-            return IntObject(1)
+            return obj_true
         else:
-            return IntObject(0)
+            return obj_false
     else:
         raise Exception_type('Can\'t find whether \'%s\' > \'%s\'.'\
                              % (left.type, right.type))
@@ -412,14 +532,14 @@ def func_leq(arg_1, arg_2):
     if (left.type in ('int', 'float') and
         right.type in ('int', 'float')):
         if left.value <= right.value:
-            return IntObject(1)
+            return obj_true
         else:
-            return IntObject(0)
+            return obj_false
     elif left.type == 'str' and right.type == 'str':
         if left.value <= right.value:
-            return IntObject(1)
+            return obj_true
         else:
-            return IntObject(0)
+            return obj_false
     else:
         raise Exception_type('Can\'t find whether \'%s\' <= \'%s\'.'\
                              % (left.type, right.type))
@@ -430,57 +550,94 @@ def func_lnq(arg_1, arg_2):
     if (left.type in ('int', 'float') and
         right.type in ('int', 'float')):
         if left.value < right.value:
-            return IntObject(1)
+            return obj_true
         else:
-            return IntObject(0)
+            return obj_false
     elif left.type == 'str' and right.type == 'str':
         if left.value < right.value:
-            return IntObject(1)
+            return obj_true
         else:
-            return IntObject(0)
+            return obj_false
     else:
         raise Exception_type('Can\'t find whether \'%s\' < \'%s\'.'\
                              % (left.type, right.type))
 
-def func_eq(arg_1, arg_2):
-    left, right = arg_1.evaluate(), arg_2.evaluate()
-    
-    if left.type != right.type:
-        return IntObject(0)
+def equal(left, right):
+    ''' Return whether 'eq' holds for the objects. The items of lists are
+    evaluated and compared from left to right until the first difference,
+    with a stack of the lists being compared instead of recursion. Two
+    dicts are equal if they have the same keys (in any order), and equal
+    values for each key.
+    '''
+    # (the objects themselves aren't evaluated again, only the items)
+    stack = [iter(((Quote(left), Quote(right)),))]
 
-    if left.type in ('int', 'float', 'str', 'name'):
-        if left.value == right.value:
-            return IntObject(1)
-        else:
-            return IntObject(0)
-    elif left.type == 'list':
-        for i in xrange(len(left.value)):
-            if not to_boolean(func_eq(left.value[i], right.value[i])):
-                return IntObject(0)
+    while stack:
+        for left, right in stack[-1]:
+            left, right = left.evaluate(), right.evaluate()
 
-        return IntObject(1)
-    else:
-        return IntObject(0)
+            if left.type != right.type:
+                return False
 
-def func_neq(arg_1, arg_2):
-    left, right = arg_1.evaluate(), arg_2.evaluate()
-    
-    if left.type != right.type:
-        return IntObject(1)
+            if left.type in ('int', 'float', 'str', 'name'):
+                if left.value != right.value:
+                    return False
+            elif left.type == 'list':
+                # (not 'left is right' : a list holding a function isn't
+                #  equal to itself, like the function)
+                if len(left.value) != len(right.value):
+                    return False
+
+                if left.key is not None and right.key is not None:
+                    # (keys of constant lists, compared by hash first)
+                    if left.key != right.key:
+                        return False
 
-    if left.type in ('int', 'float', 'str', 'name'):
-        if left.value != right.value:
-            return IntObject(1)
+                    continue
+
+                stack.append(izip(left.value, right.value))
+                break
+            elif left.type in types_array:
+                if len(left.value) != len(right.value) or \
+                   list(left.value) != list(right.value):
+                    return False
+            elif left.type == 'dict':
+                if len(left.value) != len(right.value):
+                    return False
+
+                get_left, get_right = left.value.get, right.value.get
+                pairs = []
+
+                for key in left.value:
+                    value = get_right(key)
+
+                    if value is None:
+                        return False
+
+                    # (the values are compared as they are, like the
+                    #  objects given to 'eq')
+                    pairs.append((Quote(get_left(key)), Quote(value)))
+
+                stack.append(iter(pairs))
+                break
+            else:
+                return False
         else:
-            return IntObject(0)
-    elif left.type == 'list':
-        for i in xrange(len(left.value)):
-            if not to_boolean(func_eq(left.value[i], right.value[i])):
-                return IntObject(1)
+            stack.pop()
+
+    return True
+
+def func_eq(arg_1, arg_2):
+    if equal(arg_1.evaluate(), arg_2.evaluate()):
+        return obj_true
+    else:
+        return obj_false
 
-        return IntObject(0)
+def func_neq(arg_1, arg_2):
+    if equal(arg_1.evaluate(), arg_2.evaluate()):
+        return obj_false
     else:
-        return IntObject(1)
+        return obj_true
 
 # -------------------------------
 # arithmetic
@@ -489,26 +646,54 @@ def func_add(arg_1, arg_2):
     left, right = arg_1.evaluate(), arg_2.evaluate()
 
     if left.type == 'int' and right.type == 'int':
-        return IntObject(left.value + right.value)
+        v = left.value + right.value
+        return ints_small.get(v) or IntObject(v)
 
     if (left.type in ('int', 'float')
         and right.type in ('int', 'float')):
         return FloatObject(left.value + right.value)
 
     if left.type == 'str' and right.type == 'str':
-        return StrObject(left.value + right.value)
+        return concat_str(left, right)
 
     if left.type == 'list' and right.type == 'list':
         return ListObject(left.value + right.value)
 
+    if left.type == right.type and left.type in types_array:
+        return left.__class__(left.value + right.value)
+
     raise Exception_type('Can\'t \'add\' \'%s\' and \'%s\'.'\
                          % (left.type, right.type))
 
+def concat_str(left, right):
+    ''' Return the string object of the concatenation. A large one is a
+    rope, so that adding to it again doesn't copy it.
+    '''
+    if left.__class__ is RopeObject:
+        if right.__class__ is RopeObject:
+            return RopeObject(left.rope.extend(right.rope))
+
+        return RopeObject(left.rope.append(right.value))
+
+    length = len(left.value) + len_str(right)
+
+    if length < size_rope_min:
+        return StrObject(left.value + right.value)
+
+    return RopeObject(Rope((left.value,)).extend(to_rope(right)))
+
+def len_str(obj):
+    if obj.__class__ is RopeObject:
+        return len(obj.rope)
+    else:
+        return len(obj.value)
+
 def func_sub(arg_1, arg_2):
     left, right = arg_1.evaluate(), arg_2.evaluate()
 
     if left.type == 'int' and right.type == 'int':
-        return IntObject(left.value - right.value)
+        v = left.value - right.value
+        return ints_small.get(v) or IntObject(v)
 
     if (left.type in ('int', 'float')
         and right.type in ('int', 'float')):
@@ -521,7 +706,8 @@ def func_mul(arg_1, arg_2):
     left, right = arg_1.evaluate(), arg_2.evaluate()
 
     if left.type == 'int' and right.type == 'int':
-        return IntObject(left.value * right.value)
+        v = left.value * right.value
+        return ints_small.get(v) or IntObject(v)
 
     if (left.type in ('int', 'float')
         and right.type in ('int', 'float')):
@@ -533,6 +719,12 @@ def func_mul(arg_1, arg_2):
     if (left.type, right.type) in (('list', 'int'), ('int', 'list')):
         return ListObject(left.value * right.value)
 
+    if left.type in types_array and right.type == 'int':
+        return left.__class__(left.value * right.value)
+
+    if left.type == 'int' and right.type in types_array:
+        return right.__class__(left.value * right.value)
+
     raise Exception_type('Can\'t \'multiply\' \'%s\' and \'%s\'.'\
                          % (left.type, right.type))
 
@@ -543,7 +735,8 @@ def func_div(arg_1, arg_2):
         if right.value == 0:
             raise Exception_divbyzero('Dividing by zero is illegal.')
         else:
-            return IntObject(left.value / right.value)
+            v = left.value / right.value
+            return ints_small.get(v) or IntObject(v)
 
     if (left.type in ('int', 'float')
         and right.type in ('int', 'float')):
@@ -566,15 +759,16 @@ def func_mod(arg_1, arg_2):
         raise Exception_type('Second argument of \'mod\' should be'\
                              ' \'int\', not \'%s\'.' % right.type)
 
-    return IntObject(left.value % right.value)
+    v = left.value % right.value
+    return ints_small.get(v) or IntObject(v)
 
 def func_neg(arg):
     obj = arg.evaluate()
 
     if obj.type == 'int':
-        return IntObject(-obj.value)
+        return make_int(-obj.value)
     elif obj.type == 'float':
-        return IntObject(-obj.value)
+        return make_int(-obj.value)
     else:
         raise Exception_type('Argument of \'neg\' should be \'int\''\
                              ' or \'float\', not \'%s\'.' % obj.type)
@@ -586,25 +780,25 @@ def func_and(arg_1, arg_2):
     left, right = arg_1.evaluate(), arg_2.evaluate()
 
     if to_boolean(left) and to_boolean(right):
-        return IntObject(1)
+        return obj_true
     else:
-        return IntObject(0)
+        return obj_false
 
 def func_or(arg_1, arg_2):
     left, right = arg_1.evaluate(), arg_2.evaluate()
 
     if to_boolean(left) or to_boolean(right):
-        return IntObject(1)
+        return obj_true
     else:
-        return IntObject(0)
+        return obj_false
 
 def func_not(arg):
     obj = arg.evaluate()
 
     if to_boolean(obj):
-        return IntObject(0)
+        return obj_false
     else:
-        return IntObject(1)
+        return obj_true
 
 # -------------------------------
 # Length
@@ -613,9 +807,9 @@ def func_len(arg):
     obj = arg.evaluate()
 
     if obj.type == 'str':
-        return IntObject(len(obj.value))
-    elif obj.type == 'list':
-        return IntObject(len(obj.value))
+        return make_int(len_str(obj))
+    elif obj.type == 'list' or obj.type in types_array:
+        return make_int(len(obj.value))
     else:
         raise Exception_type('Argument of \'len\' should be \'str\''\
                              ' or \'list\', not \'%s\'.' % obj.type)
@@ -643,8 +837,597 @@ def func_range(arg_1, arg_2, arg_3):
         raise Exception_type('Third argument of \'range\' should be'\
                              ' nonzero.')
 
-    return ListObject([IntObject(e) for e in range(
-        start.value, end.value, diff.value)])
+    # (the items are made when they're used, see pvector.PRange)
+    return ListObject(PRange(start.value, end.value, diff.value,
+                             make_int))
+
+# -------------------------------
+# Stream
+# ... 'map', 'filter', 'take' and 'zip' make a stream, whose items are
+# ... computed one by one (by the generators below) when it's used by
+# ... 'for', 'fold' or 'to_list'. So a pipeline of them doesn't build
+# ... the lists between the stages.
+
+class Generated(object):
+    ''' Iterable of the items given by gen(*args). (value of a stream) '''
+    __slots__ = ('gen', 'args')
+
+    def __init__(self, gen, *args):
+        self.gen = gen
+        self.args = args
+
+    def __iter__(self):
+        return self.gen(*self.args)
+
+def check_stream_source(obj, msg):
+    if obj.type not in types_range:
+        raise Exception_type(msg + ' should be \'list\' or \'stream\','\
+                             ' not \'%s\'.' % obj.type)
+
+def iter_items(seq):
+    ''' Iterate over the (evaluated) items of the list or the stream. '''
+    if seq.type == 'list':
+        return (item.evaluate() for item in seq.value)
+    else:
+        return iter_seq(seq)
+
+def call_func(func, *args):
+    ''' Call the function (function object, or name of a user-defined or
+    built-in function) with the objects as the arguments.
+    '''
+    code = CodeObject('eval', CodeObject('list', [func] + list(args)))
+    return code.evaluate()
+
+def check_func(obj, msg):
+    if obj.type not in ('func', 'name'):
+        raise Exception_type(msg + ' should be \'func\' or \'name\','\
+                             ' not \'%s\'.' % obj.type)
+
+def gen_map(func, seq):
+    for item in iter_items(seq):
+        yield call_func(func, item)
+
+def gen_filter(func, seq):
+    for item in iter_items(seq):
+        if to_boolean(call_func(func, item)):
+            yield item
+
+def gen_take(num, seq):
+    for item in islice(iter_items(seq), num):
+        yield item
+
+def gen_zip(seq_1, seq_2):
+    for item_1, item_2 in izip(iter_items(seq_1), iter_items(seq_2)):
+        yield ListObject([item_1, item_2])
+
+def func_map(arg_1, arg_2):
+    func, seq = arg_1.evaluate(), arg_2.evaluate()
+    check_func(func, 'First argument of \'map\'')
+    check_stream_source(seq, 'Second argument of \'map\'')
+    return StreamObject(Generated(gen_map, func, seq))
+
+def func_filter(arg_1, arg_2):
+    func, seq = arg_1.evaluate(), arg_2.evaluate()
+    check_func(func, 'First argument of \'filter\'')
+    check_stream_source(seq, 'Second argument of \'filter\'')
+    return StreamObject(Generated(gen_filter, func, seq))
+
+def func_take(arg_1, arg_2):
+    num, seq = arg_1.evaluate(), arg_2.evaluate()
+
+    if num.type != 'int':
+        raise Exception_type('First argument of \'take\' should be'\
+                             ' \'int\', not \'%s\'.' % num.type)
+
+    if num.value < 0:
+        raise Exception_type('First argument of \'take\' should be'\
+                             ' nonnegative.')
+
+    check_stream_source(seq, 'Second argument of \'take\'')
+    return StreamObject(Generated(gen_take, num.value, seq))
+
+def func_zip(arg_1, arg_2):
+    seq_1, seq_2 = arg_1.evaluate(), arg_2.evaluate()
+    check_stream_source(seq_1, 'First argument of \'zip\'')
+    check_stream_source(seq_2, 'Second argument of \'zip\'')
+    return StreamObject(Generated(gen_zip, seq_1, seq_2))
+
+def func_fold(arg_1, arg_2, arg_3):
+    func, obj, seq = arg_1.evaluate(), arg_2.evaluate(), arg_3.evaluate()
+    check_func(func, 'First argument of \'fold\'')
+    check_stream_source(seq, 'Third argument of \'fold\'')
+
+    for item in iter_items(seq):
+        obj = call_func(func, obj, item)
+
+    return obj
+
+# -------------------------------
+# Bulk operations
+# ... Each one is a single pass (or a sort) over the items in Python,
+# ... instead of a loop of 'get' / 'set' / 'lnq' calls in the language.
+# ... The items are compared like by 'lnq' (numbers with numbers, and
+# ... strings with strings) and 'eq'.
+
+types_number = frozenset(('int', 'float'))
+
+def check_ordered(objs):
+    ''' Raise the error of 'lnq' unless the objects can be compared with
+    each other.
+    '''
+    types = set([obj.type for obj in objs])
+
+    if types <= types_number or types == set(('str',)):
+        return
+
+    # (the first pair which can't be compared)
+    first = objs[0].type
+
+    for obj in objs:
+        if not ((first in types_number and obj.type in types_number) or
+                first == obj.type == 'str'):
+            raise Exception_type('Can\'t find whether \'%s\' < \'%s\'.'\
+                                 % (first, obj.type))
+
+def make_match(obj):
+    ''' Return the function which says whether an (evaluated) item is
+    equal to the object, like 'eq'.
+    '''
+    if obj.type in types_scalar:
+        t, v = obj.type, obj.value
+        return lambda item: item.type == t and item.value == v
+    else:
+        return lambda item: equal(item, obj)
+
+def func_sort(arg):
+    seq = arg.evaluate()
+    check_stream_source(seq, 'Argument of \'sort\'')
+
+    if seq.type in types_array:
+        return seq.__class__(sorted(seq.value))
+
+    objs = list(iter_items(seq))
+    check_ordered(objs)
+
+    # (stable)
+    objs.sort(key = attrgetter('value'))
+    return ListObject(objs)
+
+def func_sort_by(arg_1, arg_2):
+    func, seq = arg_1.evaluate(), arg_2.evaluate()
+    check_func(func, 'First argument of \'sort_by\'')
+    check_stream_source(seq, 'Second argument of \'sort_by\'')
+
+    objs = list(iter_items(seq))
+    keys = [call_func(func, obj) for obj in objs]
+    check_ordered(keys)
+
+    values = [key.value for key in keys]
+    order = sorted(xrange(len(objs)), key = values.__getitem__)
+    return ListObject([objs[i] for i in order])
+
+def func_reverse(arg):
+    seq = arg.evaluate()
+
+    if seq.type == 'str':
+        return StrObject(seq.value[::-1])
+    elif seq.type == 'list' or seq.type in types_array:
+        return seq.__class__(seq.value[::-1])
+    else:
+        raise Exception_type('Argument of \'reverse\' should be \'str\''\
+                             ' or \'list\', not \'%s\'.' % seq.type)
+
+def func_index_of(arg_1, arg_2):
+    seq, obj = arg_1.evaluate(), arg_2.evaluate()
+
+    if seq.type == 'str':
+        if obj.type != 'str':
+            raise Exception_type('Second argument of \'index_of\' should'\
+                                 ' be \'str\', not \'%s\'.' % obj.type)
+
+        return make_int(seq.value.find(obj.value))
+
+    check_stream_source(seq, 'First argument of \'index_of\'')
+
+    if seq.type in types_array:
+        if obj.type != seq.type_item:
+            return make_int(-1)
+
+        try:
+            return make_int(list(seq.value).index(obj.value))
+        except ValueError:
+            return make_int(-1)
+
+    match = make_match(obj)
+
+    for i, item in enumerate(iter_items(seq)):
+        if match(item):
+            return make_int(i)
+
+    return make_int(-1)
+
+def func_count(arg_1, arg_2):
+    seq, obj = arg_1.evaluate(), arg_2.evaluate()
+
+    if seq.type == 'str':
+        if obj.type != 'str':
+            raise Exception_type('Second argument of \'count\' should'\
+                                 ' be \'str\', not \'%s\'.' % obj.type)
+
+        return make_int(seq.value.count(obj.value))
+
+    check_stream_source(seq, 'First argument of \'count\'')
+
+    if seq.type in types_array:
+        if obj.type != seq.type_item:
+            return make_int(0)
+
+        return make_int(list(seq.value).count(obj.value))
+
+    match = make_match(obj)
+    return make_int(len([item for item in iter_items(seq) if match(item)]))
+
+def func_sum(arg):
+    seq = arg.evaluate()
+    check_stream_source(seq, 'Argument of \'sum\'')
+
+    if seq.type in types_array:
+        v = sum(seq.value)
+    else:
+        objs = list(iter_items(seq))
+
+        for obj in objs:
+            if obj.type not in types_number:
+                raise Exception_type('Items of \'sum\' should be \'int\''\
+                                     ' or \'float\', not \'%s\'.'\
+                                     % obj.type)
+
+        # (from left to right, like $(fold add 0 ...))
+        v = sum([obj.value for obj in objs])
+
+    if v.__class__ is float:
+        return FloatObject(v)
+    else:
+        return make_int(v)
+
+def extreme(seq, name_func, choose):
+    check_stream_source(seq, 'Argument of \'%s\'' % name_func)
+
+    if seq.type in types_array and len(seq.value):
+        return seq.make(choose(seq.value))
+
+    objs = list(iter_items(seq))
+
+    if not objs:
+        raise Exception_type('Argument of \'%s\' should be nonempty.'\
+                             % name_func)
+
+    check_ordered(objs)
+    return choose(objs, key = attrgetter('value'))
+
+def func_min(arg):
+    return extreme(arg.evaluate(), 'min', min)
+
+def func_max(arg):
+    return extreme(arg.evaluate(), 'max', max)
+
+# -------------------------------
+# Vector operations
+# ... Elementwise arithmetic / comparison of arrays and lists of numbers
+# ... in one pass (see vector.py). A number as an operand stands for a
+# ... vector of that number. The result is an array : 'int_array' if
+# ... all of the operands are integers, otherwise 'float_array'.
+
+def to_vector(obj, msg):
+    ''' Return the array.array of the numbers of the array or the list
+    object, or the number of the int / float object.
+    '''
+    if obj.type in types_array:
+        return obj.value.flatten()
+    elif obj.type in types_number:
+        return obj.value
+    elif obj.type == 'list':
+        objs = [item.evaluate() for item in obj.value]
+
+        for item in objs:
+            if item.type not in types_number:
+                raise Exception_type('Items of the list (%s) should be'\
+                                     ' \'int\' or \'float\', not'\
+                                     ' \'%s\'.' % (msg, item.type))
+
+        if all(item.type == 'int' for item in objs):
+            typecode = 'l'
+        else:
+            typecode = 'd'
+
+        try:
+            return array(typecode, [item.value for item in objs])
+        except OverflowError:
+            raise_overflow()
+    else:
+        raise Exception_type(msg + ' should be \'int_array\','\
+                             ' \'float_array\', \'list\' or a number,'\
+                             ' not \'%s\'.' % obj.type)
+
+def get_vectors(name_func, *objs):
+    ''' Return the vectors of the arguments (see to_vector). '''
+    vectors = [to_vector(obj, '%s argument of \'%s\''
+                         % (names_ordinal[i], name_func))
+               for i, obj in enumerate(objs)]
+    lengths = [len(v) for v in vectors if v.__class__ is array]
+
+    if not lengths:
+        raise Exception_type('Arguments of \'%s\' should include an'\
+                             ' array or a list.' % name_func)
+
+    if len(set(lengths)) > 1:
+        raise Exception_index('Lengths of the arguments of \'%s\' differ'\
+                              ' (%s).' % (name_func,
+                                          ', '.join(map(str, lengths))))
+
+    return vectors
+
+names_ordinal = ('First', 'Second', 'Third')
+
+def typecode_of(vectors):
+    ''' Return the typecode of the result : 'l' if all of the vectors are
+    of integers, otherwise 'd'.
+    '''
+    for v in vectors:
+        if v.__class__ is array:
+            if v.typecode == 'd':
+                return 'd'
+        elif v.__class__ is float:
+            return 'd'
+
+    return 'l'
+
+def make_vector(values, typecode):
+    if typecode == 'l':
+        return IntArrayObject(values)
+    else:
+        return FloatArrayObject(values)
+
+def make_number(value):
+    if value.__class__ is float:
+        return FloatObject(value)
+    else:
+        return make_int(value)
+
+def apply_vector(name_func, name_op, arg_1, arg_2):
+    vectors = get_vectors(name_func, arg_1.evaluate(), arg_2.evaluate())
+
+    if name_op in vector.ops_compare:
+        typecode = 'l'
+    else:
+        typecode = typecode_of(vectors)
+
+    try:
+        return make_vector(vector.binary(name_op, vectors[0], vectors[1],
+                                         typecode), typecode)
+    except OverflowError:
+        raise_overflow()
+
+def func_vadd(arg_1, arg_2):
+    return apply_vector('vadd', 'add', arg_1, arg_2)
+
+def func_vsub(arg_1, arg_2):
+    return apply_vector('vsub', 'sub', arg_1, arg_2)
+
+def func_vmul(arg_1, arg_2):
+    return apply_vector('vmul', 'mul', arg_1, arg_2)
+
+def func_vcmp_eq(arg_1, arg_2):
+    return apply_vector('vcmp_eq', 'eq', arg_1, arg_2)
+
+def func_vcmp_neq(arg_1, arg_2):
+    return apply_vector('vcmp_neq', 'neq', arg_1, arg_2)
+
+def func_vcmp_lnq(arg_1, arg_2):
+    return apply_vector('vcmp_lnq', 'lnq', arg_1, arg_2)
+
+def func_vcmp_leq(arg_1, arg_2):
+    return apply_vector('vcmp_leq', 'leq', arg_1, arg_2)
+
+def func_vcmp_gnq(arg_1, arg_2):
+    return apply_vector('vcmp_gnq', 'gnq', arg_1, arg_2)
+
+def func_vcmp_geq(arg_1, arg_2):
+    return apply_vector('vcmp_geq', 'geq', arg_1, arg_2)
+
+def func_vsum(arg):
+    vectors = get_vectors('vsum', arg.evaluate())
+    return make_number(vector.total(vectors[0], typecode_of(vectors)))
+
+def func_vdot(arg_1, arg_2):
+    vectors = get_vectors('vdot', arg_1.evaluate(), arg_2.evaluate())
+    return make_number(vector.dot(vectors[0], vectors[1],
+                                  typecode_of(vectors)))
+
+def func_where(arg_1, arg_2, arg_3):
+    cond, v_true, v_false = get_vectors('where', arg_1.evaluate(),
+                                        arg_2.evaluate(), arg_3.evaluate())
+
+    if cond.__class__ is not array:
+        raise Exception_type('First argument of \'where\' should be'\
+                             ' an array or a list.')
+
+    typecode = typecode_of((v_true, v_false))
+    return make_vector(vector.where(cond, v_true, v_false, typecode),
+                       typecode)
+
+# -------------------------------
+# Memoization
+# ... 'memo' makes a function which remembers its recent results: a call
+# ... with the same arguments (compared by their keys, see to_key) gives
+# ... the result of the earlier call instead of running the body again.
+# ... The engines bind the arguments as usual, and then pass the call to
+# ... Memo if the function has one.
+
+class Memo(object):
+    ''' LRU cache of the results of a user-defined function. '''
+    __slots__ = ('func', 'size_max', 'results', 'hits', 'misses')
+
+    def __init__(self, func, size_max):
+        self.func = func # (not memoized)
+        self.size_max = size_max
+        self.results = OrderedDict() # (the least recently used first)
+        self.hits = self.misses = 0
+
+    def call(self, objs):
+        ''' Return the result of the function for the arguments. '''
+        key = tuple([to_key(obj) for obj in objs])
+        results = self.results
+        obj_return = results.pop(key, None)
+
+        if obj_return is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            obj_return = call_function(self.func, 'Unnamed', [
+                Quote(obj) if obj.type == 'code' else obj for obj in objs])
+
+            if len(results) >= self.size_max:
+                results.popitem(last = False)
+
+        results[key] = obj_return
+        return obj_return
+
+    def call_bound(self):
+        ''' Return the result of the function for the arguments bound to
+        the parameters in the current frame (wound by the engine).
+        '''
+        lookup_variable = frame.lookup_variable
+        return self.call([lookup_variable(p) for p in self.func.params])
+
+def func_memo(arg_1, arg_2):
+    func, size_max = arg_1.evaluate(), arg_2.evaluate()
+
+    if func.type != 'func':
+        raise Exception_type('First argument of \'memo\' should be'\
+                             ' \'func\', not \'%s\'.' % func.type)
+
+    if size_max.type != 'int':
+        raise Exception_type('Second argument of \'memo\' should be'\
+                             ' \'int\', not \'%s\'.' % size_max.type)
+
+    if size_max.value <= 0:
+        raise Exception_type('Second argument of \'memo\' should be'\
+                             ' positive.')
+
+    if func.memo is not None:
+        func = func.memo.func
+
+    return FuncObject(func.params, func.codes, func.layout,
+                      Memo(func, size_max.value))
+
+def func_memo_stats(arg):
+    func = arg.evaluate()
+
+    if func.type != 'func' or func.memo is None:
+        raise Exception_type('Argument of \'memo_stats\' should be a'\
+                             ' function made by \'memo\'.')
+
+    memo = func.memo
+    return ListObject([make_int(memo.hits), make_int(memo.misses),
+                       make_int(len(memo.results))])
+
+# -------------------------------
+# Dict
+# ... A dict is immutable like the other objects : 'dict_set' returns a
+# ... new dict, which shares most of the map with the old one.
+
+# (types of the keys : a key is compared by its value, see to_key)
+types_key = ('int', 'float', 'str', 'name', 'list') + types_array
+
+def check_dict(obj, name_func):
+    if obj.type != 'dict':
+        raise Exception_type('First argument of \'%s\' should be'\
+                             ' \'dict\', not \'%s\'.' % (name_func, obj.type))
+
+def check_key(obj, name_func):
+    if obj.type not in types_key:
+        raise Exception_type('Second argument of \'%s\' can\'t be'\
+                             ' \'%s\'.' % (name_func, obj.type))
+
+def func_dict_new():
+    return DictObject()
+
+def func_dict_get(arg_1, arg_2):
+    d, key = arg_1.evaluate(), arg_2.evaluate()
+    check_dict(d, 'dict_get')
+    check_key(key, 'dict_get')
+
+    obj = d.value.get(to_key(key))
+
+    if obj is None:
+        raise Exception_index('Can\'t \'dict_get\' the key %s which'\
+                              ' isn\'t in the dict.' % key)
+
+    return obj
+
+def func_dict_set(arg_1, arg_2, arg_3):
+    d, key = arg_1.evaluate(), arg_2.evaluate()
+    check_dict(d, 'dict_set')
+    check_key(key, 'dict_set')
+
+    obj = arg_3.evaluate()
+    value = d.value.set(to_key(key), obj)
+
+    if len(value) == len(d.value):
+        # (the key was already in)
+        return DictObject(value, d.keys)
+    else:
+        return DictObject(value, d.keys.append(key))
+
+def func_dict_has(arg_1, arg_2):
+    d, key = arg_1.evaluate(), arg_2.evaluate()
+    check_dict(d, 'dict_has')
+    check_key(key, 'dict_has')
+
+    if to_key(key) in d.value:
+        return obj_true
+    else:
+        return obj_false
+
+def func_dict_keys(arg):
+    d = arg.evaluate()
+    check_dict(d, 'dict_keys')
+    return ListObject(d.keys)
+
+# -------------------------------
+# String builder
+# ... A builder collects strings in a rope : 'sb_append' returns a new
+# ... builder without copying the strings so far, and 'sb_to_str' makes
+# ... the string at the end.
+
+def func_sb_new():
+    return BuilderObject(Rope())
+
+def func_sb_append(arg_1, arg_2):
+    sb, obj = arg_1.evaluate(), arg_2.evaluate()
+
+    if sb.type != 'builder':
+        raise Exception_type('First argument of \'sb_append\' should be'\
+                             ' \'builder\', not \'%s\'.' % sb.type)
+
+    if obj.type != 'str':
+        raise Exception_type('Second argument of \'sb_append\' should be'\
+                             ' \'str\', not \'%s\'.' % obj.type)
+
+    if obj.__class__ is RopeObject:
+        return BuilderObject(sb.value.extend(obj.rope))
+    else:
+        return BuilderObject(sb.value.append(obj.value))
+
+def func_sb_to_str(arg):
+    sb = arg.evaluate()
+
+    if sb.type != 'builder':
+        raise Exception_type('Argument of \'sb_to_str\' should be'\
+                             ' \'builder\', not \'%s\'.' % sb.type)
+
+    return make_str(sb.value)
 
 # -------------------------------
 # Indexing
@@ -652,7 +1435,7 @@ def func_range(arg_1, arg_2, arg_3):
 def func_get(arg_1, arg_2):
     seq, index = arg_1.evaluate(), arg_2.evaluate()
 
-    if seq.type not in ('str', 'list'):
+    if seq.type not in types_seq:
         raise Exception_type('First argument of \'get\' should be'\
                              ' \'str\' or \'list\', not \'%s\'.'\
                              % seq.type)
@@ -662,22 +1445,28 @@ def func_get(arg_1, arg_2):
                              ' \'int\', not \'%s\'.' % index.type)
 
     try:
-        v = seq.value[index.value]
+        if seq.__class__ is RopeObject:
+            v = seq.rope[index.value]
+        else:
+            v = seq.value[index.value]
     except IndexError:
         raise Exception_index('Can\'t \'get\' %dth item of \'%s\' whose'\
                               ' length is %d.'\
-                              % (index.value, seq.type, len(seq.value)))
+                              % (index.value, seq.type, len_str(seq)
+                                 if seq.type == 'str' else len(seq.value)))
 
     if seq.type == 'str':
         return StrObject(v)
-    else:
+    elif seq.type == 'list':
         return v.evaluate()
+    else:
+        return seq.make(v)
 
 def func_set(arg_1, arg_2, arg_3):
     seq, index = arg_1.evaluate(), arg_2.evaluate()
     obj = arg_3.evaluate()
     
-    if seq.type not in ('str', 'list'):
+    if seq.type not in types_seq:
         raise Exception_type('First argument of \'set\' should be'\
                              ' \'str\' or \'list\', not \'%s\'.'\
                              % seq.type)
@@ -711,20 +1500,18 @@ def func_set(arg_1, arg_2, arg_3):
             raise Exception_type('For the strings, third argument of'\
                                  ' \'set\' should be \'str\', not'\
                                  ' \'%s\'.' % obj.type)
+    elif seq.type == 'list':
+        return ListObject(seq.value.set(index.value, obj))
     else:
-        index_pos = index.value % len(seq.value)
-
-        value_new = seq.value[:index_pos] + [obj]\
-                + seq.value[index_pos+1:]
-
-        return ListObject(value_new)
+        return seq.__class__(seq.value.set(index.value,
+                                           to_item(seq.__class__, obj)))
 
 def func_slice(arg_1, arg_2, arg_3, arg_4):
     seq = arg_1.evaluate()
     start, end = arg_2.evaluate(), arg_3.evaluate()
     diff = arg_4.evaluate()
 
-    if seq.type not in ('str', 'list'):
+    if seq.type not in types_seq:
         raise Exception_type('First argument of \'slice\' should be'\
                              ' \'str\' or \'list\', not \'%s\'.'\
                              % seq.type)
@@ -745,10 +1532,12 @@ def func_slice(arg_1, arg_2, arg_3, arg_4):
         raise Exception_type('Fourth argument of \'slice\' should be'\
                              ' nonzero.')
 
-    if seq.type == 'str':
+    if seq.__class__ is RopeObject:
+        return StrObject(seq.rope[start.value:end.value:diff.value])
+    elif seq.type == 'str':
         return StrObject(seq.value[start.value:end.value:diff.value])
     else:
-        return ListObject(seq.value[start.value:end.value:diff.value])
+        return seq.__class__(seq.value[start.value:end.value:diff.value])
 
 # -------------------------------
 # Copy
@@ -0,0 +1,230 @@
+''' On-disk cache of parsed programs.
+
+parse(src, path) returns the same code object tree as parser.parse(src),
+but keeps the tree in a file of the cache directory ('~/.cache/simplelang',
+one file per source file). The next run of the same source reads the tree
+back instead of lexing and parsing it again.
+
+The cache file is the marshalled (magic, hash of the source, tree), where
+the tree is a flat encoding of the code objects (see to_tree). A file
+whose magic or hash doesn't match (other version, or the source was
+changed) is just replaced.
+'''
+
+from __future__ import with_statement
+import os
+import sys
+import marshal
+import hashlib
+import parser
+from object import CodeObject
+
+# (changes when the format of the tree or of marshal, or the decoding of
+#  the sources changes)
+magic = 'SimpleLang-code-3-py%d%d' % sys.version_info[:2]
+
+def parse(src, path):
+    ''' Return the code object of the source (read from the file at the
+    path), from the cache if possible.
+    '''
+    path_cache = get_path_cache(path)
+    digest = hashlib.sha1(src).digest()
+
+    code = load(path_cache, digest)
+
+    if code is None:
+        code = parser.parse(src)
+        save(path_cache, digest, code)
+
+    return code
+
+def get_path_cache(path):
+    ''' Return the path of the cache file of the source file. '''
+    dir_base = os.environ.get('XDG_CACHE_HOME') or \
+            os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.abspath(path)
+    name = '%s-%s.code' % (os.path.basename(path),
+                           hashlib.sha1(path).hexdigest()[:16])
+    return os.path.join(dir_base, 'simplelang', name)
+
+def load(path_cache, digest):
+    ''' Return the cached code object, or None. '''
+    try:
+        with open(path_cache, 'rb') as f:
+            magic_file, digest_file, tree = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+
+    if magic_file != magic or digest_file != digest:
+        return None
+
+    try:
+        return from_tree(tree)
+    except (KeyError, StopIteration, ValueError, TypeError):
+        # (broken file)
+        return None
+
+def save(path_cache, digest, code):
+    ''' Write the code object to the cache. (The cache is optional, so
+    failing to write it isn't an error.)
+    '''
+    path_temp = '%s.%d' % (path_cache, os.getpid())
+
+    try:
+        dir_parent = os.path.dirname(path_cache)
+
+        if not os.path.isdir(dir_parent):
+            os.makedirs(dir_parent)
+
+        with open(path_temp, 'wb') as f:
+            marshal.dump((magic, digest, to_tree(code)), f)
+
+        # (replace at once, so another run never reads half of the file)
+        os.rename(path_temp, path_cache)
+    except (IOError, OSError, ValueError):
+        pass
+
+# -----------------------------------------------------------
+# code object <-> tree
+# ... The tree is the code objects in preorder : a string of one
+# ... character per code object (its op), and a list of the arguments
+# ... (value of a constant / name, or number of items of a list).
+
+chars_op = {'int' : 'i', 'float' : 'f', 'str' : 's', 'name' : 'n',
+            'list' : 'l', 'eval' : 'e'}
+
+ops_char = dict((ch, op) for op, ch in chars_op.items())
+
+def to_tree(code):
+    ops, args = [], []
+    # (iterative, like parser.parse_forms : a deeply nested program
+    #  doesn't hit Python's recursion limit)
+    stack = [code] # codes left to write, the next one last
+
+    while stack:
+        code = stack.pop()
+        op, arg = code.op, code.arg
+        ops.append(chars_op[op])
+
+        if op == 'list':
+            args.append(len(arg))
+            stack.extend(reversed(arg))
+        elif op == 'eval':
+            stack.append(arg)
+        elif op == 'name':
+            # (marshal writes an interned string only once)
+            args.append(intern(arg))
+        else:
+            args.append(arg)
+
+    return ''.join(ops), args
+
+def from_tree(tree):
+    ops, args = tree
+    next_arg = iter(args).next
+    root = None
+    stack = [] # [code, number of its codes left to read] of each list /
+               # eval not read yet
+
+    for ch in ops:
+        op = ops_char[ch]
+
+        if op == 'list':
+            code, num = CodeObject(op, []), next_arg()
+        elif op == 'eval':
+            code, num = CodeObject(op, None), 1
+        else:
+            code, num = CodeObject(op, next_arg()), 0
+
+        if stack:
+            parent = stack[-1]
+
+            if parent[0].op == 'list':
+                parent[0].arg.append(code)
+            else:
+                parent[0].arg = code
+
+            parent[1] -= 1
+
+            if not parent[1]:
+                stack.pop()
+        elif root is None:
+            root = code
+        else:
+            # (codes after the end of the tree)
+            raise ValueError
+
+        if num:
+            stack.append([code, num])
+
+    if root is None or stack:
+        # (end of the tree missing)
+        raise ValueError
+
+    return root
+
+# -----------------------------------------------------------
+
+def test():
+    import shutil
+    import tempfile
+
+    print '[Code cache test]'
+
+    dir_temp = tempfile.mkdtemp()
+    os.environ['XDG_CACHE_HOME'] = dir_temp
+
+    try:
+        path = os.path.join(dir_temp, 'test.simple')
+        path_cache = get_path_cache(path)
+
+        def check(src):
+            ''' Parse the source through the cache, and check it gives the
+            tree of the parser, also cached.
+            '''
+            tree = to_tree(parser.parse(src))
+            assert to_tree(parse(src, path)) == tree
+            code = load(path_cache, hashlib.sha1(src).digest())
+            assert code is not None and to_tree(code) == tree
+
+        # round trip
+        src = '$(let f $(func (a) ($(mul $a 2.5)))) ' \
+              '$(print $(f 2) "a b" () (1 ($x) $$y))'
+        check(src)
+        check('%s1%s' % ('$(' * 3000, ')' * 3000))
+        check('$(print %s1%s)' % ('(' * 3000, ')' * 3000))
+
+        print 'round trip - ok'
+
+        # stale source hash : the cache of the old source is replaced
+        check(src)
+        assert load(path_cache, hashlib.sha1(src + ' ').digest()) is None
+        check(src + ' $(print 1)')
+        assert load(path_cache, hashlib.sha1(src).digest()) is None
+
+        print 'stale source - ok'
+
+        # corrupt cache file : parsed again, and the file is replaced
+        digest = hashlib.sha1(src).digest()
+        tree = to_tree(parser.parse(src))
+        ops, args = tree
+
+        for data in ('', 'garbage',
+                     marshal.dumps((magic, digest)),
+                     marshal.dumps((magic, digest, (ops, args[:-1]))),
+                     marshal.dumps((magic, digest, (ops[:-1], args))),
+                     marshal.dumps((magic, digest, (ops + 'i', args + [1]))),
+                     marshal.dumps((magic, digest, ('x' + ops, args))),
+                     marshal.dumps((magic, digest, ('l', [-1])))):
+            with open(path_cache, 'wb') as f:
+                f.write(data)
+
+            assert load(path_cache, digest) is None
+            check(src)
+
+        print 'corrupt file - ok'
+    finally:
+        shutil.rmtree(dir_temp)
+
+if __name__ == '__main__':
+    test()
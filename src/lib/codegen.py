@@ -0,0 +1,378 @@
+''' Compilation of code objects into Python closures.
+
+The parser produces a tree of code objects, and CodeObject.evaluate
+walks that tree (and compares 'op' against every kind of node) each
+time the code runs. compile_code() does that dispatch once: every code
+object in the tree gets a closure specialized for its kind, and the
+closure is bound to the object's 'evaluate', so the built-in functions
+(which only call arg.evaluate()) run the compiled version transparently.
+The statements ('return', 'if', 'for', ...) also get a closure bound to
+'execute', which gives signals instead of raising interrupts.
+'''
+
+import frame
+from object import FloatObject, StrObject, ListObject,\
+        NameObject, CodeObject, names_statement, make_int, obj_false,\
+        call_function
+from exception import Exception_lookup, Exception_arg, Exception_type
+from interrupt import Interrupt_tailcall, Signal, signal_return,\
+        signal_break, signal_continue, signal_tailcall
+
+obj_zero = obj_false
+
+def compile_code(code):
+    ''' Compile the code object and all of its children. Return the
+    code object itself (whose 'evaluate' is now the compiled closure).
+    '''
+    if not isinstance(code, CodeObject):
+        return code
+
+    op, arg = code.op, code.arg
+
+    if op == 'list':
+        for c in arg:
+            compile_code(c)
+    elif op == 'eval':
+        compile_code(arg)
+
+    code.evaluate = make_closure(code)
+    code.execute = make_statement(code) or code.evaluate
+    return code
+
+def make_closure(code):
+    ''' Return the closure which evaluates the given code object. '''
+    op, arg = code.op, code.arg
+
+    if op == 'int':
+        return make_const(make_int, arg)
+    elif op == 'float':
+        return make_const(FloatObject, arg)
+    elif op == 'str':
+        return make_const(StrObject, arg)
+    elif op == 'list':
+        return make_const(ListObject, arg)
+    elif op == 'name':
+        return make_const(NameObject, arg)
+    elif op == 'eval':
+        if arg.op == 'name':
+            return make_lookup(arg.arg)
+        elif arg.op == 'list':
+            if not arg.arg:
+                return make_error(Exception_type,
+                                  'Can\'t evaluate an empty list.')
+
+            head, args = arg.arg[0], arg.arg[1:]
+
+            if isinstance(head, CodeObject) and head.op == 'name':
+                if head.arg == 'return' and len(args) == 1:
+                    return make_return(args[0])
+
+                return make_call_named(code, head.arg, args)
+            else:
+                return make_call_dynamic(head, args)
+        else:
+            # $(else) -> return itself
+            return arg.evaluate
+    else:
+        return lambda: None
+
+def make_statement(code):
+    ''' Return the closure which executes the given code object as a
+    statement (see CodeObject.execute), or None if it's the same as the
+    one of evaluate.
+    '''
+    op, arg = code.op, code.arg
+
+    if op != 'eval' or arg.op != 'list' or not arg.arg:
+        return None
+
+    head, args = arg.arg[0], arg.arg[1:]
+
+    if not (isinstance(head, CodeObject) and head.op == 'name' and
+            head.arg in names_statement):
+        return None
+
+    builtin, num_params = frame.lookup_builtin(head.arg)
+
+    if len(args) != num_params:
+        return None
+
+    if head.arg == 'return':
+        return make_statement_return(code, args[0])
+    elif head.arg == 'break':
+        return make_statement_signal(code, 'break', signal_break)
+    elif head.arg == 'continue':
+        return make_statement_signal(code, 'continue', signal_continue)
+    else:
+        return make_statement_call(code, head.arg, builtin, args)
+
+# -----------------------------------------------------------
+# closures for each kind of code
+
+def make_const(cls, value):
+    # (objects are immutable, so one object serves every evaluation)
+    obj = cls(value)
+
+    def run():
+        return obj
+
+    return run
+
+def make_error(cls, msg):
+    def run():
+        raise cls(msg)
+
+    return run
+
+def make_slot_cache():
+    ''' Return the inline cache of a name, [layout, slot index]. The
+    layout is the one of the last frame the name was resolved in.
+    '''
+    # (no layout is 'missing', so the cache misses at first)
+    return [frame.missing, 0]
+
+def update_slot_cache(cache, layout, name):
+    if layout is not None:
+        i = layout.get(name)
+
+        if i is not None:
+            cache[0], cache[1] = layout, i
+
+def make_lookup(name):
+    lookup_variable = frame.lookup_variable
+    missing = frame.missing
+    cache = make_slot_cache()
+
+    def run():
+        f = frame.frame_curr
+
+        # variable of a user-defined function -> read the slot directly
+        if f.layout is cache[0]:
+            obj = f.slots[cache[1]]
+
+            if obj is not missing and obj is not None:
+                return obj
+        else:
+            update_slot_cache(cache, f.layout, name)
+
+        obj = lookup_variable(name)
+
+        if obj is None:
+            raise Exception_lookup(
+                'Failed to find the variable with the name'\
+                ' \'%s\'.' % name)
+
+        return obj
+
+    return run
+
+def make_call_named(code, func_name, args):
+    lookup_variable = frame.lookup_variable
+    missing = frame.missing
+    names_bound = frame.names_bound
+    cache = make_slot_cache()
+    num_args = len(args)
+
+    # built-in functions never change after loading, so resolve
+    # them here instead of on every call
+    builtin, num_params = frame.lookup_builtin(func_name)
+
+    if num_args != num_params:
+        builtin = None
+    elif func_name in names_statement:
+        builtin = raise_signal(builtin)
+
+    def run():
+        # (a name which has never been bound -> always the built-in one)
+        if func_name in names_bound:
+            f = frame.frame_curr
+
+            if f.layout is cache[0]:
+                func = f.slots[cache[1]]
+
+                if func is missing:
+                    func = lookup_variable(func_name)
+            else:
+                update_slot_cache(cache, f.layout, func_name)
+                func = lookup_variable(func_name)
+
+            if func is not None:
+                return call_function(func, func_name, args)
+
+        if builtin is None:
+            return call_builtin(func_name, args)
+
+        obj_return = builtin(*args)
+
+        if obj_return is None:
+            return obj_zero
+        else:
+            return obj_return
+
+    def resolve_call():
+        ''' Return (function, name, arguments) if the call is to a
+        user-defined function, otherwise None. (for tail calls)
+        '''
+        if func_name not in names_bound:
+            return None
+
+        func = lookup_variable(func_name)
+
+        if func is None:
+            return None
+
+        return func, func_name, args
+
+    if code is not None:
+        code.resolve_call = resolve_call
+
+    return run
+
+def make_return(arg):
+    ''' $(return <arg>) : If <arg> is a call to a user-defined function,
+    raise Interrupt_tailcall instead of making the call, so the caller's
+    loop (call_function) makes it in place of the current one.
+    '''
+    run_general = make_call_named(None, 'return', [arg])
+    resolve_call = getattr(arg, 'resolve_call', None)
+
+    if resolve_call is None:
+        return run_general
+
+    names_bound = frame.names_bound
+
+    def run():
+        # (not shadowed, and inside a user-defined function)
+        if 'return' not in names_bound and frame.depth_call:
+            target = resolve_call()
+
+            if target is not None:
+                raise Interrupt_tailcall(*target)
+
+        return run_general()
+
+    return run
+
+def make_statement_return(code, arg):
+    ''' $(return <arg>) as a statement : Give signal_return, or
+    signal_tailcall if <arg> is a call to a user-defined function.
+    '''
+    lookup_variable = frame.lookup_variable
+    names_bound = frame.names_bound
+    run_general = code.evaluate
+    resolve_call = getattr(arg, 'resolve_call', None)
+
+    def run():
+        if 'return' in names_bound and \
+           lookup_variable('return') is not None:
+            return run_general()
+
+        if resolve_call is not None and frame.depth_call:
+            target = resolve_call()
+
+            if target is not None:
+                signal_tailcall.target = target
+                return signal_tailcall
+
+        signal_return.obj_return = arg.evaluate()
+        return signal_return
+
+    return run
+
+def make_statement_signal(code, func_name, signal):
+    ''' $(break), $(continue) as a statement : Give the signal. '''
+    lookup_variable = frame.lookup_variable
+    names_bound = frame.names_bound
+    run_general = code.evaluate
+
+    def run():
+        if func_name in names_bound and \
+           lookup_variable(func_name) is not None:
+            return run_general()
+
+        return signal
+
+    return run
+
+def make_statement_call(code, func_name, builtin, args):
+    ''' $(if ...), $(for ...), ... as a statement : Pass the signal given
+    by the codes of the built-in function.
+    '''
+    lookup_variable = frame.lookup_variable
+    names_bound = frame.names_bound
+    run_general = code.evaluate
+
+    def run():
+        if func_name in names_bound and \
+           lookup_variable(func_name) is not None:
+            return run_general()
+
+        obj_return = builtin(*args)
+
+        if obj_return is None:
+            return obj_zero
+        else:
+            return obj_return
+
+    return run
+
+def make_call_dynamic(head, args):
+    lookup_variable = frame.lookup_variable
+
+    def run():
+        func_request = head.evaluate()
+
+        if func_request.type == 'name':
+            func_name = func_request.value
+            func = lookup_variable(func_name)
+
+            if func is None:
+                return call_builtin(func_name, args)
+
+            return call_function(func, func_name, args)
+        else:
+            return call_function(func_request, 'Unnamed', args)
+
+    return run
+
+# -----------------------------------------------------------
+# calling convention (same as CodeObject.evaluate, and
+# object.call_function for the user-defined functions)
+
+def call_builtin(func_name, args):
+    ''' Call the built-in function with such name. '''
+    func, num_params = frame.lookup_builtin(func_name)
+
+    if func is None:
+        raise Exception_lookup('Function \'%s\' doesn\'t exist.'\
+                               % func_name)
+
+    num_args = len(args)
+
+    if num_args != num_params:
+        raise Exception_arg('Function \'%s\' expected %d'\
+                            ' arguments, but it got %d.'\
+                            % (func_name, num_params, num_args))
+
+    obj_return = func(*args)
+
+    if obj_return is None:
+        return obj_zero
+    elif obj_return.__class__ is Signal:
+        raise obj_return.interrupt()
+    else:
+        return obj_return
+
+def raise_signal(func):
+    ''' Wrap the built-in function which may give a signal, to call it
+    inside an expression (where the signal must be raised).
+    '''
+    def run(*args):
+        obj_return = func(*args)
+
+        if obj_return.__class__ is Signal:
+            raise obj_return.interrupt()
+
+        return obj_return
+
+    return run
@@ -4,21 +4,47 @@ assignment.
 
 class FrameObject(object):
     ''' 'frame' object - An simple object which stores the mapping
-    of variables and their names.
+    of variables and their names. The variables of the parent frame
+    are visible through 'parent' (not copied).
+    * A frame of a user-defined function has a 'layout' (name -> index,
+      see make_layout), and stores those variables in the fixed-size
+      list 'slots'. Only the other names go to 'map_variable', which is
+      created when it's first needed.
     '''
-    def __init__(self, parent = None, map_variable = None):
+    def __init__(self, parent = None, map_variable = None,
+                 layout = None):
         self.parent = parent
+        self.layout = layout
 
-        if map_variable is None:
-            self.map_variable = {}
+        if layout is None:
+            self.slots = None
+
+            if map_variable is None:
+                self.map_variable = {}
+            else:
+                self.map_variable = map_variable
         else:
+            self.slots = [missing] * len(layout)
             self.map_variable = map_variable
 
 # ------------------------------------------------------
 
+# marker for the names not in a frame
+# (None is stored for the names which aren't in any frame)
+missing = object()
+
 map_builtin = {} # built-in functions
 frame_curr = FrameObject() # current working frame
 
+# number of the calls of user-defined functions running (see
+# object.call_function). A frame left wound by an error or by 'break'
+# out of a function doesn't count, unlike frame_curr.parent.
+depth_call = 0
+
+# names which have ever been assigned
+# (the others, ex. names of built-in functions, aren't in any frame)
+names_bound = set()
+
 def assign_builtin(name, func, num_params):
     ''' Load built-in function in the current scope. '''
     map_builtin[name] = (func, num_params)
@@ -29,23 +55,135 @@ def lookup_builtin(name):
 
 def assign_variable(name, obj):
     ''' Map given object to the name in the current scope. '''
+    names_bound.add(name)
+    layout = frame_curr.layout
+
+    if layout is not None:
+        i = layout.get(name)
+
+        if i is not None:
+            frame_curr.slots[i] = obj
+            return
+
+        if frame_curr.map_variable is None:
+            frame_curr.map_variable = {}
+
     frame_curr.map_variable[name] = obj
 
 def lookup_variable(name):
     ''' Lookup the name in the current scope, and return the matching
     object. If it doesn't exist, return None.
+    * If the name isn't in the current frame, search the parent frames
+      and cache the result in the current frame. (Only the current
+      frame is assigned, so the parent frames can't change while it is
+      alive.)
     '''
-    return frame_curr.map_variable.get(name, None)
+    layout = frame_curr.layout
+
+    if layout is not None:
+        i = layout.get(name)
+
+        if i is not None:
+            obj = frame_curr.slots[i]
+
+            if obj is missing:
+                obj = frame_curr.slots[i] = lookup_parent(name)
+
+            return obj
+
+        if frame_curr.map_variable is None:
+            frame_curr.map_variable = {}
 
-def wind_frame():
-    ''' Generate a new child frame and import variables from the parent
-    frame. '''
+    map_curr = frame_curr.map_variable
+    obj = map_curr.get(name, missing)
+
+    if obj is missing:
+        obj = map_curr[name] = lookup_parent(name)
+
+    return obj
+
+def lookup_parent(name):
+    ''' Lookup the name in the parent frames of the current frame. '''
+    if name not in names_bound:
+        return None
+
+    f = frame_curr.parent
+
+    while f is not None:
+        layout = f.layout
+
+        if layout is not None and name in layout:
+            obj = f.slots[layout[name]]
+
+            if obj is not missing:
+                return obj
+        elif f.map_variable is not None:
+            obj = f.map_variable.get(name, missing)
+
+            if obj is not missing:
+                return obj
+
+        f = f.parent
+
+    return None
+
+def make_layout(params, codes):
+    ''' Resolve the names used in the body of a user-defined function
+    (= params, names assigned by 'let' or 'for', and names looked up)
+    into slot indices. Return the layout (name -> index).
+    * Names computed at runtime (ex. $(let $name 3)) can't be resolved,
+      so they are stored in 'map_variable' of the frame.
+    '''
+    layout = {}
+
+    def add(name):
+        if name not in layout:
+            layout[name] = len(layout)
+
+    def visit(code):
+        if getattr(code, 'type', None) != 'code':
+            return
+
+        op, arg = code.op, code.arg
+
+        if op == 'list':
+            for c in arg:
+                visit(c)
+        elif op == 'eval':
+            if arg.op == 'name':
+                add(arg.arg)
+            elif arg.op == 'list' and arg.arg:
+                head = arg.arg[0]
+
+                if head.type == 'code' and head.op == 'name':
+                    add(head.arg)
+
+                    # the body of a nested function has its own frame
+                    if head.arg == 'func':
+                        return
+
+                for c in arg.arg[1:]:
+                    if c.type == 'code' and c.op == 'name':
+                        add(c.arg)
+                    else:
+                        visit(c)
+            else:
+                visit(arg)
+
+    for p in params:
+        add(p)
+
+    for c in codes:
+        visit(c)
+
+    return layout
+
+def wind_frame(layout = None):
+    ''' Generate a new child frame. (It sees the variables of the parent
+    frame, but assigning them only changes the child frame.) '''
     global frame_curr
 
-    frame_curr = FrameObject(
-        parent = frame_curr,
-        map_variable = frame_curr.map_variable.copy()
-    )
+    frame_curr = FrameObject(parent = frame_curr, layout = layout)
 
 def unwind_frame():
     ''' Return to the parent frame. '''
@@ -53,6 +191,51 @@ def unwind_frame():
 
     frame_curr = frame_curr.parent
 
+def collapse_frame():
+    ''' Merge the parent frame into the current frame, and make the
+    grandparent the new parent. Used for tail calls: the caller's frame
+    isn't needed after the call, but its variables should stay visible
+    to the callee (under the callee's own ones).
+    '''
+    f, p = frame_curr, frame_curr.parent
+
+    if p.layout is not None:
+        if p.layout is f.layout:
+            slots = f.slots
+
+            for i, obj in enumerate(p.slots):
+                if slots[i] is missing:
+                    slots[i] = obj
+        else:
+            for name, i in p.layout.iteritems():
+                obj = p.slots[i]
+
+                if obj is not missing:
+                    merge_variable(f, name, obj)
+
+    if p.map_variable:
+        for name, obj in p.map_variable.iteritems():
+            merge_variable(f, name, obj)
+
+    f.parent = p.parent
+
+def merge_variable(f, name, obj):
+    ''' Map given object to the name in the frame f, unless f already
+    has the name.
+    '''
+    layout = f.layout
+
+    if layout is not None and name in layout:
+        i = layout[name]
+
+        if f.slots[i] is missing:
+            f.slots[i] = obj
+    else:
+        if f.map_variable is None:
+            f.map_variable = {}
+
+        f.map_variable.setdefault(name, obj)
+
 # ------------------------------------------------------
 
 def test():
@@ -13,3 +13,41 @@ class Interrupt_loop(Interrupt_base):
     ''' Interrupt for 'for', 'continue'. ''' 
     def __init__(self, status):
         self.status = status
+
+class Interrupt_tailcall(Interrupt_base):
+    ''' Interrupt for 'return' of a call to a user-defined function.
+    (The caller makes the call instead, reusing its frame.) '''
+    def __init__(self, func, func_name, args):
+        self.func = func
+        self.func_name = func_name
+        self.args = args
+
+# -----------------------------------------------------------
+# Signals - exception-free version of the interrupts
+
+class Signal(object):
+    ''' Result of a code run as a statement (see CodeObject.execute)
+    which stops the codes around it, instead of raising an interrupt.
+    There is only one object for each kind, so the flow control doesn't
+    allocate anything.
+    '''
+    def __init__(self, kind):
+        self.kind = kind
+        self.obj_return = None # value of 'return'
+        self.target = None # (func, func_name, args) of 'tailcall'
+
+    def interrupt(self):
+        ''' Return the matching interrupt. (for the places where the
+        signal can't be passed, ex. an argument of a function)
+        '''
+        if self.kind == 'return':
+            return Interrupt_return(self.obj_return)
+        elif self.kind == 'tailcall':
+            return Interrupt_tailcall(*self.target)
+        else:
+            return Interrupt_loop(self.kind)
+
+signal_return = Signal('return')
+signal_break = Signal('break')
+signal_continue = Signal('continue')
+signal_tailcall = Signal('tailcall')
@@ -1,14 +1,27 @@
-''' Definition of the objects used in the language. '''
+''' Definition of the objects used in the language.
+
+* The objects are immutable: no built-in function modifies its arguments,
+  'set' and 'add' make a new object, and so on. So an object is shared
+  instead of copied (copy() returns itself), while every variable still
+  behaves as if it was passed by value.
+'''
 
 import frame
+from itertools import imap
+from pvector import PVector, PRange
+from pmap import PMap
+from rope import Rope
 from exception import Exception_lookup, Exception_arg, Exception_type
-from interrupt import Interrupt_return
+from interrupt import Interrupt_return, Interrupt_tailcall, Signal,\
+        signal_return, signal_break, signal_continue, signal_tailcall
 
 class IntObject(object):
     ''' Integer object. '''
+    __slots__ = ('value',)
+    type = 'int'
+
     def __init__(self, value):
         self.value = value
-        self.type = 'int'
 
     def __str__(self):
         return '%d' % self.value
@@ -17,18 +30,32 @@ class IntObject(object):
         return self.__str__()
 
     def copy(self):
-        return IntObject(self.value)
+        return self
 
     def evaluate(self):
         return self
 
+    def execute(self):
+        return self
+
+# small integers (including the booleans 0 and 1) are preallocated, and
+# make_int() returns them instead of new objects (they're immutable)
+ints_small = dict((i, IntObject(i)) for i in xrange(-5, 1025))
+obj_false, obj_true = ints_small[0], ints_small[1]
+
+def make_int(value):
+    # (hot paths inline this, to save a call)
+    return ints_small.get(value) or IntObject(value)
+
 # -----------------------------------------------------------
 
 class FloatObject(object):
     ''' Floating-point object. '''
+    __slots__ = ('value',)
+    type = 'float'
+
     def __init__(self, value):
         self.value = value
-        self.type = 'float'
 
     def __str__(self):
         value_raw = '%f' % self.value
@@ -47,18 +74,23 @@ class FloatObject(object):
         return self.__str__()
 
     def copy(self):
-        return FloatObject(self.value)
+        return self
 
     def evaluate(self):
         return self
 
+    def execute(self):
+        return self
+
 # -----------------------------------------------------------
 
 class StrObject(object):
     ''' String object. '''
+    __slots__ = ('value',)
+    type = 'str'
+
     def __init__(self, value):
         self.value = value
-        self.type = 'str'
 
     def __str__(self):
         return '%s' % self.value
@@ -67,18 +99,114 @@ class StrObject(object):
         return self.__str__()
 
     def copy(self):
-        return StrObject(self.value)
+        return self
+
+    def evaluate(self):
+        return self
+
+    def execute(self):
+        return self
+
+class RopeObject(object):
+    ''' String object of a large string made by concatenations. (rope is
+    a Rope, see rope.py) It's the same 'str' as StrObject, but 'len',
+    'get', 'slice' and 'add' use the rope, and the Python string (value)
+    is made only when another function uses it.
+    '''
+    __slots__ = ('rope', 'flat')
+    type = 'str'
+
+    def __init__(self, rope):
+        self.rope = rope
+        self.flat = None
+
+    @property
+    def value(self):
+        if self.flat is None:
+            self.flat = str(self.rope)
+
+        return self.flat
+
+    def __str__(self):
+        # (not kept, ex. for 'print')
+        if self.flat is None:
+            return str(self.rope)
+
+        return self.flat
+
+    def __repr__(self):
+        return self.__str__()
+
+    def copy(self):
+        return self
+
+    def evaluate(self):
+        return self
+
+    def execute(self):
+        return self
+
+# strings made by concatenations are ropes from this length
+size_rope_min = 1024
+
+def to_rope(obj):
+    ''' Return the rope of the string object. '''
+    if obj.__class__ is RopeObject:
+        return obj.rope
+    else:
+        return Rope((obj.value,))
+
+def make_str(rope):
+    ''' Return the string object of the rope. '''
+    if len(rope) < size_rope_min:
+        return StrObject(str(rope))
+    else:
+        return RopeObject(rope)
+
+# -----------------------------------------------------------
+
+class BuilderObject(object):
+    ''' String builder object. (value is a Rope of the strings appended
+    so far)
+    '''
+    __slots__ = ('value',)
+    type = 'builder'
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return '<Builder>'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def copy(self):
+        return self
 
     def evaluate(self):
         return self
 
+    def execute(self):
+        return self
+
 # -----------------------------------------------------------
 
 class ListObject(object):
-    ''' List object. '''
+    ''' List object. (value is a persistent vector, or a lazy range;
+    see pvector.py)
+    '''
+    # ('key' : structural key, cached by to_key)
+    __slots__ = ('value', 'key')
+    type = 'list'
+
     def __init__(self, value):
-        self.value = [e.copy() for e in value]
-        self.type = 'list'
+        if value.__class__ in (PVector, PRange):
+            self.value = value
+        else:
+            self.value = PVector(value)
+
+        self.key = None
 
     def __str__(self):
         return '(%s)' % ' '.join(str(e) for e in self.value)
@@ -87,18 +215,112 @@ class ListObject(object):
         return self.__str__()
 
     def copy(self):
-        return ListObject([e.copy() for e in self.value])
+        return self
 
     def evaluate(self):
         return self
 
+    def execute(self):
+        return self
+
+# -----------------------------------------------------------
+
+class ArrayObject(object):
+    ''' Base of the array objects : lists of numbers of one type, stored
+    as raw values. (value is a typed persistent vector, see pvector.py)
+    The items are made into objects only when they're taken out.
+    '''
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        if value.__class__ is PVector:
+            self.value = value
+        else:
+            self.value = PVector(value, self.typecode)
+
+    def __str__(self):
+        make = self.make
+        return '(%s)' % ' '.join(str(make(v)) for v in self.value)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def copy(self):
+        return self
+
+    def evaluate(self):
+        return self
+
+    def execute(self):
+        return self
+
+class IntArrayObject(ArrayObject):
+    ''' Array of integers. (of C long) '''
+    __slots__ = ()
+    type = 'int_array'
+    type_item = 'int'
+    typecode = 'l'
+    make = staticmethod(make_int)
+
+class FloatArrayObject(ArrayObject):
+    ''' Array of floating-point numbers. (of C double) '''
+    __slots__ = ()
+    type = 'float_array'
+    type_item = 'float'
+    typecode = 'd'
+    make = FloatObject
+
+types_array = ('int_array', 'float_array')
+
+# types of the sequences of 'for' and of the sources of streams
+types_range = ('list', 'stream') + types_array
+
+def iter_seq(obj):
+    ''' Iterate over the items of the list, stream or array object (the
+    items of a list as they are, not evaluated).
+    '''
+    if obj.type in types_array:
+        return imap(obj.make, obj.value)
+    else:
+        return iter(obj.value)
+
+# -----------------------------------------------------------
+
+class StreamObject(object):
+    ''' Stream object. (lazy sequence made by 'map', 'filter', ...)
+    value is an iterable which computes the items again on each iteration,
+    so a stream can be used several times, like a list.
+    '''
+    __slots__ = ('value',)
+    type = 'stream'
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return '<Stream>'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def copy(self):
+        return self
+
+    def evaluate(self):
+        return self
+
+    def execute(self):
+        return self
+
 # -----------------------------------------------------------
 
 class NameObject(object):
     ''' Name (= Identifier) object. '''
+    __slots__ = ('value',)
+    type = 'name'
+
     def __init__(self, value):
         self.value = value
-        self.type = 'name'
 
     def __str__(self):
         return '<Name %s>' % self.value
@@ -107,20 +329,69 @@ class NameObject(object):
         return self.__str__()
 
     def copy(self):
-        return NameObject(self.value)
+        return self
 
     def evaluate(self):
         return self
 
+    def execute(self):
+        return self
+
+# -----------------------------------------------------------
+
+class DictObject(object):
+    ''' Dict object. value is a persistent hash map (see pmap.py) from
+    the keys of the key objects (see to_key) to the value objects, and
+    keys is a persistent vector of the key objects in the order they
+    were added.
+    '''
+    __slots__ = ('value', 'keys')
+    type = 'dict'
+
+    def __init__(self, value = None, keys = None):
+        self.value = PMap() if value is None else value
+        self.keys = PVector() if keys is None else keys
+
+    def __str__(self):
+        get = self.value.get
+        return '{%s}' % ', '.join('%s : %s' % (key, get(to_key(key)))
+                                  for key in self.keys)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def copy(self):
+        return self
+
+    def evaluate(self):
+        return self
+
+    def execute(self):
+        return self
+
 # -----------------------------------------------------------
 
 class FuncObject(object):
     ''' Function object. '''
-    def __init__(self, params, codes):
-        self.value = {'params' : params, 'codes' : codes}
+    # ('chunk' : instructions of the body, cached by vm.py)
+    # ('memo' : cache of the results if memoized, see builtin.Memo)
+    __slots__ = ('params', 'codes', 'layout', 'chunk', 'memo')
+    type = 'func'
+
+    def __init__(self, params, codes, layout = None, memo = None):
         self.params = params
         self.codes = codes
-        self.type = 'func'
+        self.memo = memo
+
+        # slots of the frame (see frame.make_layout)
+        if layout is None:
+            self.layout = frame.make_layout(params, codes)
+        else:
+            self.layout = layout
+
+    @property
+    def value(self):
+        return {'params' : self.params, 'codes' : self.codes}
 
     def __str__(self):
         names_params = ['var_%d' % (i + 1)
@@ -131,20 +402,38 @@ class FuncObject(object):
         return self.__str__()
 
     def copy(self):
-        return FuncObject(self.params[:], self.codes[:])
+        return self
 
     def evaluate(self):
         return self
 
+    def execute(self):
+        return self
+
 # -----------------------------------------------------------
 
 class CodeObject(object):
     ''' Code object. '''
+    # (no __slots__ : the engines bind their closures to 'evaluate' and
+    #  'execute' of each instance, over the methods below)
+    type = 'code'
+
+    # inline cache of the call $(name ...) of a built-in function :
+    # (name, function, arguments), set by the first call. It's used while
+    # the name isn't bound to a variable. (see frame.names_bound)
+    cache_call = None
+
+    # resolver of a call in tail position, bound by an engine which has
+    # its own (codegen : with the slot cache). see call_function
+    resolve_call = None
+
     def __init__(self, op, arg):
-        self.value = {'op' : op, 'arg' : arg}
         self.op = op
         self.arg = arg
-        self.type = 'code'
+
+    @property
+    def value(self):
+        return {'op' : self.op, 'arg' : self.arg}
 
     def __str__(self):
         return '<Code %s : %s>' % (self.op, self.arg)
@@ -153,14 +442,15 @@ class CodeObject(object):
         return self.__str__()
 
     def copy(self):
-        return CodeObject(self.op, self.arg)
+        # (this also keeps the closure bound by codegen)
+        return self
 
     def evaluate(self):
         op = self.op
 
         # convert code object to 'real' value
         if op == 'int':
-            return IntObject(self.arg)
+            return make_int(self.arg)
         elif op == 'float':
             return FloatObject(self.arg)
         elif op == 'str':
@@ -188,6 +478,19 @@ class CodeObject(object):
 
             # $(list) -> function call
             elif code_target.op == 'list':
+                cache = self.cache_call
+
+                if cache is not None and cache[0] not in frame.names_bound:
+                    # -> skip the lookups and the check of the arguments
+                    obj_return = cache[1](*cache[2])
+
+                    if obj_return is None:
+                        return make_int(0)
+                    elif obj_return.__class__ is Signal:
+                        raise obj_return.interrupt()
+                    else:
+                        return obj_return
+
                 if not code_target.arg:
                     raise Exception_type(
                         'Can\'t evaluate an empty list.')
@@ -212,10 +515,20 @@ class CodeObject(object):
                                     ' arguments, but it got %d.'\
                                     % (func_name, num_params, num_args))
 
+                            head = code_target.arg[0]
+
+                            if head.__class__ is CodeObject and \
+                               head.op == 'name':
+                                self.cache_call = (func_name, func, args)
+
                             obj_return = func(*args)
 
                             if obj_return is None:
-                                return IntObject(0)
+                                return make_int(0)
+                            elif obj_return.__class__ is Signal:
+                                # ex. $(if ...) stopped by 'return'
+                                # -> we can't pass it, so raise it
+                                raise obj_return.interrupt()
                             else:
                                 return obj_return
 
@@ -228,49 +541,297 @@ class CodeObject(object):
                     func_name = 'Unnamed'
                     func = func_request
 
-                if func.type != 'func':
-                    raise Exception_type('Cannot call \'%s\'.'\
-                                         % func.type)
-
-                # call user-defined function
-                # 1) set a new frame ('winding')
-                # 2) push the arguments
-                # 3) eval. the codes until Interrupt_return is raised
-                # 4) return to the parent frame ('unwinding')
-                # 5) get the return value
-                #    (obj. passed by Interrupt_return or
-                #     the value of the last code)
+                return call_function(func, func_name, args)
+
+            # $(else) -> return itself
+            else:
+                return code_target.evaluate()
+
+        # what should I do???
+        else:
+            pass
+
+    def execute(self):
+        ''' Evaluate the code as a statement. (a code of the body of a
+        user-defined function, 'if', 'for', 'while' or 'main')
+        Unlike evaluate(), 'return', 'break' and 'continue' give a signal
+        instead of raising an interrupt, and 'if', 'if_else', 'for' and
+        'while' pass the signal given by their codes.
+        '''
+        if self.op == 'eval' and self.arg.op == 'list' and self.arg.arg:
+            head, args = self.arg.arg[0], self.arg.arg[1:]
+
+            if (head.type == 'code' and head.op == 'name' and
+                head.arg in names_statement and
+                (head.arg not in frame.names_bound or
+                 frame.lookup_variable(head.arg) is None)):
+                func_name = head.arg
+                func, num_params = frame.lookup_builtin(func_name)
+
+                if len(args) == num_params:
+                    if func_name == 'return':
+                        if frame.depth_call:
+                            # (inside a user-defined function)
+                            target = resolve_call(args[0])
+
+                            if target is not None:
+                                signal_tailcall.target = target
+                                return signal_tailcall
+
+                        signal_return.obj_return = args[0].evaluate()
+                        return signal_return
+                    elif func_name == 'break':
+                        return signal_break
+                    elif func_name == 'continue':
+                        return signal_continue
+
+                    obj_return = func(*args)
+
+                    if obj_return is None:
+                        return make_int(0)
+                    else:
+                        return obj_return
+
+        return self.evaluate()
+
+# -----------------------------------------------------------
+# calling convention of the user-defined functions
+
+def call_function(func, func_name, args):
+    ''' Call the user-defined function.
+    1) set a new frame ('winding')
+    2) push the arguments
+    3) exec. the codes until one gives a signal
+    4) return to the parent frame ('unwinding')
+    5) get the return value
+       (obj. passed by signal_return or the value of the last code)
+    * A call to a user-defined function in tail position (the last code
+      of the body, or the argument of 'return') isn't nested: this loop
+      makes it instead, and merges the caller's frame into the callee's
+      one. So tail recursion runs in constant Python stack and memory.
+    * The codes of the body are run as statements, so 'return' (and the
+      tail call) usually comes as a signal, not as an interrupt.
+    * The tree and closure engines (and the built-in functions calling
+      back a user-defined function, on every engine) share this loop.
+      The last code is resolved by its own 'resolve_call' if the engine
+      bound one, otherwise by resolve_call() below.
+    '''
+    check_call(func, func_name, args)
+    frame.wind_frame(func.layout)
+    bind_args(func, args)
+
+    # (the arguments above are the caller's : a 'return' in them is the
+    #  caller's one)
+    tail_call = None
+    frame.depth_call += 1
+
+    try:
+        while 1:
+            try:
+                if tail_call is not None:
+                    # -> merge the caller's frame into the callee's one
+                    func, func_name, args = tail_call
+                    tail_call = None
+                    check_call(func, func_name, args)
+                    frame.wind_frame(func.layout)
+                    bind_args(func, args)
+                    frame.collapse_frame()
+
+                if func.memo is not None:
+                    # memoized -> the result may be known
+                    obj_return = func.memo.call_bound()
+                    break
+
                 codes = func.codes
-                params, num_params = func.params, len(func.params)
 
-                if num_args != num_params:
-                    raise Exception_arg(
-                        'Function \'%s\' expected %d'\
-                        ' arguments, but it got %d.'\
-                        % (func_name, num_params, num_args))
+                if not codes:
+                    obj_return = make_int(0)
+                    break
 
-                frame.wind_frame()
+                for i in xrange(len(codes) - 1):
+                    obj_return = codes[i].execute()
 
-                for i in xrange(num_args):
-                    frame.assign_variable(params[i], args[i].evaluate())
+                    if obj_return.__class__ is Signal:
+                        break
+                else:
+                    code_last = codes[-1]
+                    resolve = getattr(code_last, 'resolve_call', None)
 
-                try:
-                    for c in codes:
-                        obj_return = c.evaluate()
-                except Interrupt_return as e:
-                    obj_return = e.obj_return
+                    if resolve is not None:
+                        tail_call = resolve()
+                    else:
+                        tail_call = resolve_call(code_last)
 
-                frame.unwind_frame()
+                    if tail_call is not None:
+                        continue
 
-                return obj_return
+                    obj_return = code_last.execute()
 
-            # $(else) -> return itself
-            else:
-                return code_target.evaluate()
+                    if obj_return.__class__ is not Signal:
+                        break
 
-        # what should I do???
-        else:
-            pass
+                # stopped by a signal
+                if obj_return is signal_return:
+                    obj_return = obj_return.obj_return
+                    break
+                elif obj_return is signal_tailcall:
+                    tail_call = obj_return.target
+                else:
+                    # 'break' or 'continue' of the caller's loop
+                    raise obj_return.interrupt()
+            except Interrupt_return as e:
+                # 'return' inside an expression
+                obj_return = e.obj_return
+                break
+            except Interrupt_tailcall as e:
+                tail_call = e.func, e.func_name, e.args
+    finally:
+        frame.depth_call -= 1
+
+    frame.unwind_frame()
+
+    return obj_return
+
+def resolve_call(code):
+    ''' Return (function, name, arguments) if the code is a call
+    $(name ...) to a user-defined function, otherwise None. (for tail
+    calls)
+    '''
+    if code.__class__ is not CodeObject or code.op != 'eval' or \
+       code.arg.op != 'list' or not code.arg.arg:
+        return None
+
+    head = code.arg.arg[0]
+
+    # (a name which has never been bound -> always the built-in one)
+    if head.__class__ is not CodeObject or head.op != 'name' or \
+       head.arg not in frame.names_bound:
+        return None
+
+    func = frame.lookup_variable(head.arg)
+
+    if func is None:
+        return None
+
+    return func, head.arg, code.arg.arg[1:]
+
+def check_call(func, func_name, args):
+    if func.type != 'func':
+        raise Exception_type('Cannot call \'%s\'.' % func.type)
+
+    num_args, num_params = len(args), len(func.params)
+
+    if num_args != num_params:
+        raise Exception_arg('Function \'%s\' expected %d'\
+                            ' arguments, but it got %d.'\
+                            % (func_name, num_params, num_args))
+
+def bind_args(func, args):
+    params = func.params
+
+    for i in xrange(len(args)):
+        frame.assign_variable(params[i], args[i].evaluate())
+
+class Quote(object):
+    ''' Value of an argument which is a code object itself (ex. the
+    variable of 'for' over a lazy list). The function must get the code
+    object back from 'evaluate', not the result of running it.
+    '''
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def evaluate(self):
+        return self.obj
+
+# built-in functions which give (or pass) signals as statements
+names_statement = ('return', 'break', 'continue',
+                   'if', 'if_else', 'for', 'while')
+
+# -----------------------------------------------------------
+# structural key
+# ... to_key() gives a hashable Python value for an object, so that two
+# ... objects have the same key iff 'eq' says they're equal (int 1 and
+# ... float 1.0 aren't). The other objects (functions, streams, ...)
+# ... are their own keys, i.e. compared by identity.
+
+types_scalar = ('int', 'float', 'str', 'name')
+
+class KeyList(object):
+    ''' Key of a list object : the keys of its items, and their hash
+    computed once (a tuple computes it again on each lookup).
+    '''
+    __slots__ = ('items', 'hash')
+
+    def __init__(self, items):
+        self.items = items
+        self.hash = hash(items)
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return self is other or (other.__class__ is KeyList and
+                                 self.hash == other.hash and
+                                 self.items == other.items)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+def to_key(obj):
+    t = obj.type
+
+    if t in types_scalar:
+        # (the hash of a Python str is cached in the str)
+        return (t, obj.value)
+    elif t == 'list':
+        key = obj.key
+
+        if key is None:
+            key = key_list(obj)
+
+        return key
+    elif t in types_array:
+        return (t, tuple(obj.value))
+    elif t == 'dict':
+        # (the same entries in any order)
+        get = obj.value.get
+        return (t, frozenset([(key, to_key(get(key))) for key in obj.value]))
+    elif t == 'code' and obj.op in types_scalar:
+        # (constant taken from a list as it is, ex. by 'for')
+        return (t, obj.op, obj.arg)
+    else:
+        return obj
+
+def key_list(obj):
+    ''' Return the key of the list object. The key is cached in the object
+    only if all of its items are constant : an item of a literal list may
+    be an expression (ex. $x), evaluated again each time. And only if
+    they're all compared by value : 'eq' compares two lists by their
+    cached keys, but a function is unequal even to itself.
+    '''
+    keys, constant = [], True
+
+    for item in obj.value:
+        if item.__class__ is CodeObject and item.op == 'eval':
+            constant = False
+
+        item = item.evaluate()
+        key = to_key(item)
+        keys.append(key)
+
+        if key is item or item.type == 'dict' or \
+           (item.type == 'list' and item.key is None):
+            # (compared by identity, or may hold such an object)
+            constant = False
+
+    key = KeyList(tuple(keys))
+
+    if constant:
+        obj.key = key
+
+    return key
 
 # -----------------------------------------------------------
 
@@ -373,5 +934,36 @@ def test():
     print 'ex) $(bar 3 2) ->', code_1.evaluate()
     print 'ex) $(bar 3 2.0) ->', code_2.evaluate()
 
+    # ---------------------------------------------
+    # equality ('eq')
+
+    print '\n4) Equality\n'
+
+    # (the objects of the module 'object' imported by builtin, not of
+    #  this script)
+    import builtin as b
+
+    f = b.FuncObject([], [])
+    d = b.DictObject(b.PMap().set(b.to_key(b.make_int(1)), f))
+    ints = [b.make_int(1), b.make_int(2)]
+
+    for name, items, result in (
+            ('list of ints', ints, True),
+            ('list of a function', [f], False),
+            ('list of a list of a function', [b.ListObject([f])], False),
+            ('list of a dict of a function', [d], False)):
+        left, right = b.ListObject(items), b.ListObject(items)
+
+        # (the same result before and after the keys are computed)
+        for i in xrange(2):
+            assert b.equal(left, right) == result, name
+            assert b.equal(b.ListObject([left]),
+                           b.ListObject([right])) == result, name
+            b.to_key(left), b.to_key(right)
+
+        print '%s - ok' % name
+
+    assert not b.equal(f, f) and not b.equal(d, d)
+
 if __name__ == '__main__':
     test()
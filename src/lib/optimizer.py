@@ -0,0 +1,301 @@
+''' Optimization of the code object tree before it runs.
+
+optimize() makes two changes to the tree of the whole program:
+* A call of a pure built-in function ('add', 'eq', 'not', 'len', ...)
+  whose arguments are constants becomes the constant of its result.
+  Folding goes bottom-up, so $(mul 2 $(add 4 2)) becomes 12.
+* A call of 'if', 'if_else' or 'while' whose condition is a constant
+  keeps only the codes which can run ($(if 0 (...)) becomes 0).
+
+A name bound to a variable hides the built-in function with that name
+(ex. $(let add ...)), so the calls of such names must be left as they
+are. The tree is the whole program, and a name can only be bound if it
+appears in the program other than as the head of a call or a variable
+lookup: as the first argument of 'let' / 'for', a parameter of 'func',
+a name in a data list, ... Calls of all of those names are left as
+they are.
+
+Only the lists which are the codes of 'if', 'for', 'func', ... are
+optimized. A list used as data keeps its items as they were written,
+because they are visible (ex. $(to_str ($(add 1 2)))).
+'''
+
+import gc
+import frame
+from object import CodeObject
+from builtin import to_boolean
+from exception import Exception_base
+
+# kinds of the constant codes (their evaluation has no effect)
+ops_const = ('int', 'float', 'str', 'name')
+
+# pure built-in functions -> kinds of the constants they can be folded on
+# ... Lists only for the functions which don't evaluate their items.
+ops_pure = {
+    'add' : ops_const + ('list',),
+    'mul' : ops_const + ('list',),
+    'len' : ops_const + ('list',),
+    'sub' : ops_const, 'div' : ops_const, 'mod' : ops_const,
+    'neg' : ops_const, 'geq' : ops_const, 'gnq' : ops_const,
+    'leq' : ops_const, 'lnq' : ops_const, 'eq' : ops_const,
+    'neq' : ops_const, 'and' : ops_const, 'or' : ops_const,
+    'not' : ops_const
+}
+
+# built-in functions whose branches are dropped by a constant condition
+names_branch = ('if', 'if_else', 'while')
+
+# built-in functions -> indices of their arguments which are codes
+# (lists run as statements, not used as data)
+args_code = {
+    'main' : (0,), 'if' : (1,), 'if_else' : (1, 2), 'for' : (2,),
+    'while' : (1,), 'func' : (1,)
+}
+
+# longest str / list made by folding 'mul' (bigger ones are made at
+# runtime, when the code really runs)
+size_fold_max = 1024
+
+def optimize(code):
+    ''' Optimize the code object of the whole program. Return the
+    optimized code object.
+    '''
+    # (the tree has no cycles, see parser.parse)
+    enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        return fold(code, find_names_bindable(code))
+    finally:
+        if enabled:
+            gc.enable()
+
+def find_names_bindable(code):
+    ''' Return the set of the names which may be bound in the code. '''
+    names = set()
+
+    def visit(code):
+        op, arg = code.op, code.arg
+
+        if op == 'name':
+            names.add(arg)
+        elif op == 'list':
+            for c in arg:
+                visit(c)
+        elif op == 'eval':
+            if arg.op == 'name':
+                # (variable lookup)
+                return
+            elif arg.op == 'list' and arg.arg and arg.arg[0].op == 'name':
+                # (the head of a call isn't bound by the call)
+                for c in arg.arg[1:]:
+                    visit(c)
+            else:
+                visit(arg)
+
+    visit(code)
+    return names
+
+# -----------------------------------------------------------
+
+def fold(code, names_bindable):
+    ''' Return the optimized code (the code itself, or a new one). '''
+    if code.op != 'eval':
+        return code
+
+    arg = code.arg
+
+    if arg.op == 'eval':
+        code.arg = fold(arg, names_bindable)
+        return code
+    elif arg.op != 'list' or not arg.arg:
+        return code
+
+    items = arg.arg
+    head = items[0]
+
+    if head.op == 'name' and head.arg not in names_bindable:
+        func_name = head.arg
+    else:
+        # (user-defined function, or computed at runtime)
+        func_name = None
+
+        if head.op == 'eval':
+            items[0] = fold(head, names_bindable)
+
+    indices_code = args_code.get(func_name, ())
+
+    for i in xrange(1, len(items)):
+        c = items[i]
+
+        if c.op == 'eval':
+            items[i] = fold(c, names_bindable)
+        elif c.op == 'list' and i - 1 in indices_code:
+            fold_codes(c.arg, names_bindable)
+
+    if func_name in ops_pure:
+        folded = fold_call(func_name, items[1:])
+    elif func_name in names_branch:
+        folded = fold_branch(func_name, items[1:], names_bindable)
+    else:
+        return code
+
+    return folded or code
+
+def fold_codes(codes, names_bindable):
+    for i in xrange(len(codes)):
+        codes[i] = fold(codes[i], names_bindable)
+
+def fold_call(func_name, args):
+    ''' Return the constant code of the result of the call, or None if
+    it can't be folded.
+    '''
+    ops = ops_pure[func_name]
+
+    if len(args) != frame.lookup_builtin(func_name)[1]:
+        # (leave the error to the runtime)
+        return None
+
+    for c in args:
+        if c.op not in ops:
+            return None
+
+    if func_name == 'mul' and \
+       (args[0].op in ('str', 'list') or args[1].op in ('str', 'list')):
+        # (length of the result : the length of the str / list times the
+        #  int)
+        size = 1
+
+        for c in args:
+            if c.op == 'int':
+                size *= abs(c.arg)
+            elif c.op in ('str', 'list'):
+                size *= len(c.arg)
+
+        if size > size_fold_max:
+            return None
+
+    func = frame.lookup_builtin(func_name)[0]
+
+    try:
+        obj = func(*args)
+    except (Exception_base, ArithmeticError):
+        # (leave the error to the runtime)
+        return None
+
+    return to_code(obj)
+
+def fold_branch(func_name, args, names_bindable):
+    ''' Return the code which runs only the branch taken by the constant
+    condition, or None if the condition isn't a constant.
+    '''
+    if len(args) != frame.lookup_builtin(func_name)[1]:
+        return None
+
+    cond = args[0]
+
+    if cond.op not in ops_const and cond.op != 'list':
+        return None
+
+    for c in args[1:]:
+        if c.op != 'list':
+            # (type error at runtime)
+            return None
+
+    taken = to_boolean(cond.evaluate())
+
+    if func_name == 'if':
+        if taken:
+            return None
+
+        return CodeObject('int', 0)
+    elif func_name == 'if_else':
+        codes = args[1] if taken else args[2]
+
+        if not codes.arg:
+            return CodeObject('int', 0)
+
+        if 'if' in names_bindable:
+            return None
+
+        # $(if 1 <codes>)
+        return CodeObject('eval', CodeObject('list', [
+            CodeObject('name', 'if'), CodeObject('int', 1), codes]))
+    else:
+        if taken:
+            return None
+
+        return CodeObject('int', 0)
+
+def to_code(obj):
+    ''' Return the constant code which evaluates to the object. '''
+    if obj.type == 'list':
+        # (the items are the codes of the lists in the arguments)
+        return CodeObject('list', list(obj.value))
+    else:
+        return CodeObject(obj.type, obj.value)
+
+# -----------------------------------------------------------
+
+def test():
+    import parser
+    import builtin
+
+    print '[Optimizer test]'
+
+    builtin.load()
+
+    def result(src):
+        ''' Return the last top-level code of the optimized program, or
+        None if it's still a call.
+        '''
+        code = optimize(parser.parse(src)).arg.arg[1].arg[-1]
+
+        if code.op == 'eval':
+            return None
+        else:
+            return str(code)
+
+    # folding (None : left as it is)
+    for src, code in (
+            ('$(mul 2 $(add 4 2))', '<Code int : 12>'),
+            ('$(eq "a" $(add "" "a"))', '<Code int : 1>'),
+            ('$(len (1 $x 3))', '<Code int : 3>'),
+            ('$(mul "ab" 3)', '<Code str : ababab>'),
+            ('$(mul 2000 3000)', '<Code int : 6000000>'),
+            ('$(add $x 1)', None),
+            ('$(add 1)', None),
+            ('$(div 1 0)', None),
+            ('$(eq (1) (1))', None),
+            ('$(if 0 ($(print 1)))', '<Code int : 0>'),
+            ('$(while $(lnq 2 1) ($(print 1)))', '<Code int : 0>'),
+            ('$(if 1 ($(print 1)))', None)):
+        assert result(src) == code, src
+
+    print 'folding - ok'
+
+    # size of the strs / lists made by 'mul'
+    for src, code in (
+            ('$(mul "%s" 2)' % ('x' * 512), '<Code str : %s>' % ('x' * 1024)),
+            ('$(mul "%s" 1000)' % ('x' * 1000), None),
+            ('$(mul 3 "%s")' % ('x' * 500), None),
+            ('$(mul (%s) 2)' % ('1 ' * 600), None),
+            ('$(mul (1 2) 1000)', None)):
+        assert result(src) == code, src[:20]
+
+    print 'size of the results - ok'
+
+    # a name which may be bound isn't folded
+    for src in (
+            '$(let add $(func (a b) ($(sub $a $b)))) $(add 4 2)',
+            '$(let f $(func (add) ($add))) $(add 4 2)',
+            '$(for add (1 2) ()) $(add 4 2)',
+            '$(let names (a add)) $(add 4 2)'):
+        assert result(src) is None, src
+
+    assert result('$(let sub 1) $(add 4 2)') == '<Code int : 6>'
+
+    print 'bound names - ok'
+
+if __name__ == '__main__':
+    test()
@@ -1,13 +1,21 @@
-''' Lexical analysis / Parsing using PLY '''
+''' Lexical analysis / Parsing
 
-import ply.lex as lex
-import ply.yacc as yacc
+Hand-written scanner and parser of the grammar
+
+    expr : const | name | list | eval
+    eval : '$' expr
+    list : '(' expr* ')'
+
+in a single pass over the source. It produces the same code object tree
+(and the same errors) as the PLY version (parser_ply.py), which is kept
+as the reference implementation for the differential tests.
+'''
+
+import re
+import gc
 from exception import Exception_syntax
 from object import CodeObject
 
-tokens = ['NAME', 'INT', 'FLOAT', 'STR']
-literals = '$()'
-
 map_escape = {
     '\\\\' : '\\',
     '\\n' : '\n',
@@ -20,144 +28,281 @@ map_escape = {
     '\\\"' : '\"'
 }
 
-chars_escape = map_escape.keys()
+# (one regex for all escape sequences, so each string is scanned once,
+#  and the result of one sequence is never decoded again)
+re_escape = re.compile(r'\\[\\nr0tab\'"]')
 
 # --------------------------------------------------------
 # lexer
+# ... The first character decides the kind of the token, and the regex
+# ... of that kind (the same one as the PLY rule) reads the rest.
+
+re_name = re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*')
+re_number = re.compile(r'[-+]?\d+(\.\d+)?')
+re_str = re.compile(r'("(\\"|[^"])*")|(\'(\\\'|[^\'])*\')')
+re_comment = re.compile(r'\#.*')
+
+# (re_str without backtracking : a string it matches is matched by re_str
+#  in the same way however the source goes on, so it's used on a partial
+#  source, where re_str might end a string at an escaped quote)
+re_str_closed = re.compile(r'("(\\"|\\(?!")|[^"\\])*")|'
+                           r'(\'(\\\'|\\(?!\')|[^\'\\])*\')')
+
+chars_ignore = ' \n\t'
+chars_literal = '$()'
+chars_name = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_'
+chars_number = '0123456789+-'
+
+def decode_escape(m):
+    return map_escape[m.group()]
+
+def decode_str(value):
+    if '\\' not in value:
+        return value
+
+    return re_escape.sub(decode_escape, value)
+
+def tokenize(src, partial = False):
+    ''' Generate the tokens (kind, value) of the source. kind is one of
+    '$', '(', ')', 'name', 'int', 'float' and 'str'.
+    If 'partial' (the source is only the beginning of the whole one),
+    a string which isn't closed yet gives ('partial', rest of the source)
+    as the last token instead of an error.
+    '''
+    pos, end = 0, len(src)
+
+    while pos < end:
+        ch = src[pos]
+
+        if ch in chars_ignore:
+            pos += 1
+        elif ch in chars_literal:
+            yield ch, ch
+            pos += 1
+        elif ch in chars_name:
+            m = re_name.match(src, pos)
+            yield 'name', m.group()
+            pos = m.end()
+        elif ch in chars_number and re_number.match(src, pos):
+            m = re_number.match(src, pos)
+
+            if m.group(1):
+                yield 'float', float(m.group())
+            else:
+                yield 'int', int(m.group())
 
-t_ignore = ' \n\t'
-
-def t_error(t):
-    raise Exception_syntax('Invalid character \'%s\'' % t.value[0])
-
-def t_NAME(t):
-    r'[a-zA-Z_][a-zA-Z0-9_]*'
-    return t
+            pos = m.end()
+        elif ch in '"\'':
+            m = (re_str_closed if partial else re_str).match(src, pos)
 
-def t_FLOAT(t):
-    r'[-+]?\d+\.\d+'
-    t.value = float(t.value)
-    return t
+            if m is None:
+                if partial:
+                    yield 'partial', src[pos:]
+                    return
 
-def t_INT(t):
-    r'[-+]?\d+'
-    t.value = int(t.value)
-    return t
+                raise Exception_syntax('Invalid character \'%s\'' % ch)
 
-def t_STR(t):
-    r'("(\\"|[^"])*")|(\'(\\\'|[^\'])*\')'
-    value_temp = t.value[1:-1]
+            yield 'str', decode_str(m.group()[1:-1])
+            pos = m.end()
+        elif ch == '#':
+            pos = re_comment.match(src, pos).end()
+        else:
+            raise Exception_syntax('Invalid character \'%s\'' % ch)
 
-    for ch in chars_escape:
-        value_temp = value_temp.replace(ch, map_escape[ch])
+def tokenize_lines(lines):
+    ''' Generate the tokens of the source given as lines (e.g. a file
+    object), reading the next line only when the tokens of the previous
+    ones are used up. Only a string can span lines, so the lines are
+    joined only while a string isn't closed.
+    '''
+    src = ''
 
-    t.value = value_temp
+    for line in lines:
+        src += line
 
-    return t
+        for kind, value in tokenize(src, True):
+            if kind == 'partial':
+                src = value
+                break
 
-def t_COMMENT(t):
-    r'\#.*'
-    pass
+            yield kind, value
+        else:
+            src = ''
 
-lex.lex()
+    for token in tokenize(src):
+        yield token
 
 # --------------------------------------------------------
 # parser
+# ... Iterative (with a stack of the unclosed lists), so deeply nested
+# ... code doesn't hit Python's recursion limit.
 
-def p_error(p):
-    raise Exception_syntax('Wrong syntax.')
-
-def p_expr(p):
-    ''' expr : const
-             | name
-             | list
-             | eval
+def parse_forms(tokens):
+    ''' Generate the top-level expressions of the tokens, each one as
+    soon as its last token is read.
     '''
-    p[0] = p[1]
-
-def p_eval(p):
-    ''' eval : '$' expr '''
-    p[0] = CodeObject('eval', p[2])
-
-def p_list_empty(p):
-    ''' list : '(' ')' '''
-    p[0] = CodeObject('list', [])
+    lists = [] # [items, number of '$' before the next item] of each
+    items, num_evals = None, 0 # (of the top level, no list)
+
+    for kind, value in tokens:
+        if kind == '$':
+            num_evals += 1
+            continue
+        elif kind == '(':
+            lists.append((items, num_evals))
+            items, num_evals = [], 0
+            continue
+        elif kind == ')':
+            if not lists or num_evals:
+                raise Exception_syntax('Wrong syntax.')
+
+            code = CodeObject('list', items)
+            items, num_evals = lists.pop()
+        else:
+            code = CodeObject(kind, value)
 
-def p_list_nonempty(p):
-    ''' list : '(' listbody ')' '''
-    p[0] = CodeObject('list', p[2])
+        for i in xrange(num_evals):
+            code = CodeObject('eval', code)
 
-def p_listbody_single(p):
-    ''' listbody : expr '''
-    p[0] = [p[1]]
+        num_evals = 0
 
-def p_listbody_multiple(p):
-    ''' listbody : listbody expr '''
-    p[0] = p[1] + [p[2]]
+        if lists:
+            items.append(code)
+        else:
+            yield code
 
-def p_name(p):
-    ''' name : NAME '''
-    p[0] = CodeObject('name', p[1])
+    if lists or num_evals:
+        raise Exception_syntax('Wrong syntax.')
 
-def p_int(p):
-    ''' const : INT '''
-    p[0] = CodeObject('int', p[1])
+def parse_expr(src):
+    ''' Parse the source which is exactly one expression. '''
+    tokens = tokenize(src)
 
-def p_float(p):
-    ''' const : FLOAT '''
-    p[0] = CodeObject('float', p[1])
+    for code in parse_forms(tokens):
+        for token in tokens:
+            # (second expression at the top level)
+            raise Exception_syntax('Wrong syntax.')
 
-def p_str(p):
-    ''' const : STR '''
-    p[0] = CodeObject('str', p[1])
+        return code
 
-yacc.yacc(debug = False)
+    raise Exception_syntax('Wrong syntax.')
 
 # --------------------------------------------------------
 # main code
 
 def parse(src):
-    return yacc.parse('$(main (%s\n))' % src)
-
-# --------------------------------------------------------
+    # the tree has no cycles, but the cyclic GC would scan it again and
+    # again while it grows (-> superlinear time on large sources)
+    enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        return parse_expr('$(main (%s\n))' % src)
+    finally:
+        if enabled:
+            gc.enable()
+
+def parse_file(f):
+    ''' Generate the top-level codes of the source file (the codes which
+    parse() puts into 'main') one by one, while reading the file. So the
+    codes can run before the rest of the file is read.
+    '''
+    enabled = gc.isenabled()
+    gc.disable()
 
-def test():
-    from pprint import pprint
+    try:
+        for code in parse_forms(tokenize_lines(f)):
+            # (GC is enabled while the code runs)
+            if enabled:
+                gc.enable()
 
-    print '[Parser test]'
+            yield code
 
-    src = '$(let A 1)\n'\
-            '$(let b 2)\n'\
-            '$(print $(add $a $b))'
+            gc.disable()
+    finally:
+        if enabled:
+            gc.enable()
 
-    print '\n1) Source code\n'
-    print src
-
-    print '\n2) Lexer\n'
-    lex.input(src)
+# --------------------------------------------------------
 
-    while 1:
-        t = lex.token()
+def test():
+    import glob
+    import os
+    import parser_ply
 
-        if t: 
-            if t.type in literals:
-                print 'Literal |', t.value
-            else:
-                print '%7s' % t.type, '|', t.value
-        else:
-            break
+    print '[Parser test]'
 
-    print '\n3) Parser\n'
-    
     def to_tuple(code):
         if isinstance(code.arg, CodeObject):
             return (code.op, to_tuple(code.arg))
         elif isinstance(code.arg, list):
             return (code.op, map(to_tuple, code.arg))
         else:
-            return (code.op, code.arg)
-
-    pprint(to_tuple(parse(src)))
+            return (code.op, code.arg, type(code.arg))
+
+    def result(parse, src):
+        try:
+            return to_tuple(parse(src))
+        except Exception_syntax as e:
+            return str(e)
+
+    # compare with the PLY version
+    dir_examples = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'examples')
+    srcs = [open(path).read()
+            for path in sorted(glob.glob(dir_examples + '/*.simple'))]
+
+    srcs += [
+        '', '$', '()', ')', '$(a b) $(c)', '$$$x', '$()', '($ )',
+        '(1 +2 -3 4.5 -0.25 12abc _x1)', '1.', '3 - 4', '(a) ~',
+        '"a\\"b" \'c\\\'d\' "e\\\\" "\\\\n" "x\ny"', '"abc', '# end',
+        '$(a # comment ) \n b)', '((((((((((1))))))))))' * 3, '\r'
+    ]
+
+    num_fail = 0
+
+    for src in srcs:
+        if result(parse, src) != result(parser_ply.parse, src):
+            print 'Differs :', repr(src[:60])
+            num_fail += 1
+
+    print '%d sources, %d differ' % (len(srcs), num_fail)
+
+    # escape sequences (each one decoded once, from left to right)
+    for value, value_decoded in ((r'a\\nb', 'a\\nb'), (r'\\\'', '\\\''),
+                                 (r'\t\q\\', '\t\\q\\'), ('abc', 'abc')):
+        assert decode_str(value) == value_decoded, value
+
+    print 'escape sequences - ok'
+
+    # parse_file gives the codes of 'main' of parse()
+    from StringIO import StringIO
+
+    def result_file(src):
+        try:
+            return map(to_tuple, parse_file(StringIO(src)))
+        except Exception_syntax as e:
+            return str(e)
+
+    def result_main(src):
+        try:
+            return map(to_tuple, parse(src).arg.arg[1].arg)
+        except Exception_syntax as e:
+            return str(e)
+
+    srcs += [
+        '"a\\"\n b" c', '\'it\\\'s\n\' x', '"a\\\\"\n"b"', '"x\n\ny',
+        '$(print "one\ntwo") # "\n$(print 3)', '"a\\\n"'
+    ]
+
+    num_fail = 0
+
+    for src in srcs:
+        if result_file(src) != result_main(src):
+            print 'Differs (file) :', repr(src[:60])
+            num_fail += 1
+
+    print '%d sources, %d differ (file)' % (len(srcs), num_fail)
 
 if __name__ == '__main__':
     test()
@@ -0,0 +1,167 @@
+''' Lexical analysis / Parsing using PLY
+
+Reference implementation of parser.py (which doesn't use PLY), for the
+differential tests. parse() returns the same code object tree.
+'''
+
+import sys
+import ply.lex as lex
+import ply.yacc as yacc
+from exception import Exception_syntax
+from object import CodeObject
+from parser import decode_str
+
+tokens = ['NAME', 'INT', 'FLOAT', 'STR']
+literals = '$()'
+
+
+# --------------------------------------------------------
+# lexer
+
+t_ignore = ' \n\t'
+
+def t_error(t):
+    raise Exception_syntax('Invalid character \'%s\'' % t.value[0])
+
+def t_NAME(t):
+    r'[a-zA-Z_][a-zA-Z0-9_]*'
+    return t
+
+def t_FLOAT(t):
+    r'[-+]?\d+\.\d+'
+    t.value = float(t.value)
+    return t
+
+def t_INT(t):
+    r'[-+]?\d+'
+    t.value = int(t.value)
+    return t
+
+def t_STR(t):
+    r'("(\\"|[^"])*")|(\'(\\\'|[^\'])*\')'
+    # (escape sequences are decoded in the same way as parser.py)
+    t.value = decode_str(t.value[1:-1])
+
+    return t
+
+def t_COMMENT(t):
+    r'\#.*'
+    pass
+
+# --------------------------------------------------------
+# parser
+
+def p_error(p):
+    raise Exception_syntax('Wrong syntax.')
+
+def p_expr(p):
+    ''' expr : const
+             | name
+             | list
+             | eval
+    '''
+    p[0] = p[1]
+
+def p_eval(p):
+    ''' eval : '$' expr '''
+    p[0] = CodeObject('eval', p[2])
+
+def p_list_empty(p):
+    ''' list : '(' ')' '''
+    p[0] = CodeObject('list', [])
+
+def p_list_nonempty(p):
+    ''' list : '(' listbody ')' '''
+    p[0] = CodeObject('list', p[2])
+
+def p_listbody_single(p):
+    ''' listbody : expr '''
+    p[0] = [p[1]]
+
+def p_listbody_multiple(p):
+    ''' listbody : listbody expr '''
+    # (append in place; 'p[1] + [p[2]]' would copy the list every time)
+    p[1].append(p[2])
+    p[0] = p[1]
+
+def p_name(p):
+    ''' name : NAME '''
+    p[0] = CodeObject('name', p[1])
+
+def p_int(p):
+    ''' const : INT '''
+    p[0] = CodeObject('int', p[1])
+
+def p_float(p):
+    ''' const : FLOAT '''
+    p[0] = CodeObject('float', p[1])
+
+def p_str(p):
+    ''' const : STR '''
+    p[0] = CodeObject('str', p[1])
+
+# --------------------------------------------------------
+# main code
+
+# the lexer and the parser are built on the first call of parse() (not
+# on import)
+built = False
+
+def build():
+    global built
+
+    if not built:
+        module = sys.modules[__name__]
+        lex.lex(module = module)
+        # (the tables are small: build them each time instead of writing
+        #  parsetab.py into the source tree)
+        yacc.yacc(module = module, debug = False, write_tables = False)
+        built = True
+
+def parse(src):
+    build()
+    return yacc.parse('$(main (%s\n))' % src)
+
+# --------------------------------------------------------
+
+def test():
+    from pprint import pprint
+
+    print '[Parser (PLY) test]'
+
+    src = '$(let A 1)\n'\
+            '$(let b 2)\n'\
+            '$(print $(add $a $b))'
+
+    print '\n1) Source code\n'
+    print src
+
+    print '\n2) Lexer\n'
+    build()
+    lex.input(src)
+
+    while 1:
+        t = lex.token()
+
+        if t: 
+            if t.type in literals:
+                print 'Literal |', t.value
+            else:
+                print '%7s' % t.type, '|', t.value
+        else:
+            break
+
+    print '\n3) Parser\n'
+    
+    def to_tuple(code):
+        if isinstance(code.arg, CodeObject):
+            return (code.op, to_tuple(code.arg))
+        elif isinstance(code.arg, list):
+            return (code.op, map(to_tuple, code.arg))
+        else:
+            return (code.op, code.arg)
+
+    pprint(to_tuple(parse(src)))
+
+if __name__ == '__main__':
+    test()
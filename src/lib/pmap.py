@@ -0,0 +1,198 @@
+''' Persistent hash map. (value of the dict objects)
+
+A hash array mapped trie: each level of the trie takes the next 5 bits of
+the hash of the key, so a lookup visits at most one node per 5 bits, and
+O(1) nodes in practice. Like PVector, the map is never modified: set()
+returns a new map which shares all of the nodes except the ones on the
+path to the changed entry.
+
+Nodes are Python lists of 32 slots. A slot is None (empty), an entry
+(hash, key, value), another node, or a Bucket of the entries whose keys
+have the same (full) hash.
+'''
+
+from pvector import BITS, WIDTH, MASK
+
+# (hashes are made non-negative, so the bits of a hash run out)
+MASK_HASH = (1 << 64) - 1
+
+class Bucket(object):
+    ''' Entries whose keys have the same hash. (items : key -> value) '''
+    __slots__ = ('hash', 'items')
+
+    def __init__(self, hash, items):
+        self.hash = hash
+        self.items = items
+
+class PMap(object):
+    ''' Persistent hash map. Supports len, 'in', get() and set(). '''
+    __slots__ = ('count', 'root')
+
+    def __init__(self, items = ()):
+        self.count, self.root = 0, [None] * WIDTH
+
+        for key, value in items:
+            self.root, added = set_node(self.root, 0,
+                                        hash(key) & MASK_HASH, key, value)
+            self.count += added
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self.get(key, missing) is not missing
+
+    def __iter__(self):
+        ''' Iterate over the keys (in the order of their hashes). '''
+        return iter_node(self.root)
+
+    def get(self, key, default = None):
+        ''' Return the value of the key, or 'default' if it isn't in. '''
+        h = hash(key) & MASK_HASH
+        node, shift = self.root, 0
+
+        while True:
+            slot = node[(h >> shift) & MASK]
+
+            if slot is None:
+                return default
+            elif slot.__class__ is tuple:
+                if slot[0] == h and (slot[1] is key or slot[1] == key):
+                    return slot[2]
+
+                return default
+            elif slot.__class__ is Bucket:
+                if slot.hash == h:
+                    return slot.items.get(key, default)
+
+                return default
+
+            node, shift = slot, shift + BITS
+
+    def set(self, key, value):
+        ''' Return a new map where the key has the value. '''
+        m = PMap.__new__(PMap)
+        m.root, added = set_node(self.root, 0, hash(key) & MASK_HASH,
+                                 key, value)
+        m.count = self.count + added
+        return m
+
+    def __repr__(self):
+        return '{%s}' % ', '.join('%r: %r' % (key, self.get(key))
+                                  for key in self)
+
+# (default of get() which is never a value)
+missing = object()
+
+# -----------------------------------------------------------
+# path copying
+
+def set_node(node, shift, h, key, value):
+    ''' Return (a copy of the node where the key has the value, whether
+    the key is new).
+    '''
+    node = list(node)
+    i = (h >> shift) & MASK
+    slot = node[i]
+    entry = (h, key, value)
+
+    if slot is None:
+        node[i] = entry
+        return node, True
+    elif slot.__class__ is tuple:
+        if slot[0] != h:
+            node[i] = merge(slot, entry, shift + BITS)
+            return node, True
+        elif slot[1] is key or slot[1] == key:
+            node[i] = entry
+            return node, False
+        else:
+            node[i] = Bucket(h, {slot[1] : slot[2], key : value})
+            return node, True
+    elif slot.__class__ is Bucket:
+        if slot.hash != h:
+            node[i] = merge(slot, entry, shift + BITS)
+            return node, True
+
+        items = dict(slot.items)
+        added = key not in items
+        items[key] = value
+        node[i] = Bucket(h, items)
+        return node, added
+    else:
+        node[i], added = set_node(slot, shift + BITS, h, key, value)
+        return node, added
+
+def hash_of(slot):
+    ''' Return the hash of an entry or a bucket. '''
+    if slot.__class__ is tuple:
+        return slot[0]
+    else:
+        return slot.hash
+
+def merge(slot_1, slot_2, shift):
+    ''' Return a node holding the two entries (or buckets), whose hashes
+    are different.
+    '''
+    node = [None] * WIDTH
+    i_1 = (hash_of(slot_1) >> shift) & MASK
+    i_2 = (hash_of(slot_2) >> shift) & MASK
+
+    if i_1 != i_2:
+        node[i_1], node[i_2] = slot_1, slot_2
+    else:
+        node[i_1] = merge(slot_1, slot_2, shift + BITS)
+
+    return node
+
+def iter_node(node):
+    for slot in node:
+        if slot is None:
+            continue
+        elif slot.__class__ is tuple:
+            yield slot[1]
+        elif slot.__class__ is Bucket:
+            for key in slot.items:
+                yield key
+        else:
+            for key in iter_node(slot):
+                yield key
+
+# -----------------------------------------------------------
+
+def test():
+    print '[PMap test]'
+
+    for n in (0, 1, 32, 33, 1024, 40000):
+        items = [(i * 7919, str(i)) for i in xrange(n)]
+        m = PMap(items)
+        d = dict(items)
+
+        assert len(m) == n and sorted(m) == sorted(d)
+        assert all(m.get(key) == value for key, value in items)
+        assert -1 not in m and m.get(-1, 'x') == 'x'
+
+        if n:
+            key = items[n / 2][0]
+            changed = m.set(key, 'y').set('new', 'z')
+
+            assert len(changed) == n + 1
+            assert changed.get(key) == 'y' and changed.get('new') == 'z'
+            assert m.get(key) == d[key] and 'new' not in m
+
+        print '%5d items - ok' % n
+
+    # keys with the same hash (hash(-1) == hash(-2))
+    m = PMap([(-1, 'a'), (-2, 'b'), (('x', -1), 'c'), (('x', -2), 'd')])
+    m_changed = m.set(-2, 'e').set(-3, 'f')
+
+    assert len(m) == 4 and len(m_changed) == 5
+    assert [m.get(k) for k in (-1, -2, ('x', -1), ('x', -2))] == \
+            ['a', 'b', 'c', 'd']
+    assert m_changed.get(-2) == 'e' and m.get(-2) == 'b'
+    assert m_changed.get(-3) == 'f' and -3 not in m
+
+    print 'same hashes - ok'
+
+if __name__ == '__main__':
+    test()
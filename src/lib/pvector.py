@@ -0,0 +1,355 @@
+''' Persistent vector. (value of the list objects)
+
+A 32-way trie whose leaves hold the items, plus a 'tail' leaf holding the
+last (up to 32) items, like the vector of Clojure. The vector is never
+modified: set() and append() return a new vector which shares all of the
+nodes except the ones on the path to the changed item, so they take
+O(log32 n) time and memory instead of copying the whole list.
+
+Nodes are Python lists. A vector of n items has (n - 1) / 32 full leaves
+in the trie, and the rest in the tail. A typed vector (of the arrays of
+numbers) has array.array leaves instead, which hold the raw values; the
+leaves are only copied by slicing, so they keep their type.
+
+PRange is the lazy counterpart made by 'range': it computes its items
+instead of storing them, and turns into a PVector only when it's changed.
+'''
+
+from array import array
+from itertools import islice, imap
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+class PVector(object):
+    ''' Persistent vector. Supports the operations of the (read-only)
+    Python lists : len, indexing, slicing, iteration, + and *.
+    '''
+    __slots__ = ('count', 'shift', 'root', 'tail')
+
+    def __init__(self, items = (), typecode = None):
+        if typecode is None:
+            items = list(items)
+        elif items.__class__ is not array or items.typecode != typecode:
+            items = array(typecode, items)
+
+        num_items = len(items)
+
+        if num_items <= WIDTH:
+            self.count, self.shift, self.root, self.tail = \
+                    num_items, BITS, [], items
+            return
+
+        # build the trie bottom-up from the full leaves
+        num_trie = (num_items - 1) & ~MASK
+        nodes = [items[i:i+WIDTH] for i in xrange(0, num_trie, WIDTH)]
+        shift = BITS
+
+        while len(nodes) > WIDTH:
+            nodes = [nodes[i:i+WIDTH] for i in xrange(0, len(nodes), WIDTH)]
+            shift += BITS
+
+        self.count, self.shift, self.root, self.tail = \
+                num_items, shift, nodes, items[num_trie:]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for leaf in self.leaves():
+            for item in leaf:
+                yield item
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, end, diff = index.indices(self.count)
+
+            if diff > 0:
+                # (stops at the end of the slice)
+                return PVector(islice(self, start, max(start, end), diff),
+                               self.typecode())
+            else:
+                return PVector(list(self)[index], self.typecode())
+
+        index = self.to_position(index)
+        return self.leaf_of(index)[index & MASK]
+
+    def __add__(self, other):
+        return self.extend(other)
+
+    def __mul__(self, times):
+        return PVector(list(self) * times, self.typecode())
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def typecode(self):
+        ''' Return the typecode of the leaves, or None if untyped. '''
+        return getattr(self.tail, 'typecode', None)
+
+    def flatten(self):
+        ''' Return the items as one Python list (one array if typed). '''
+        items = self.tail[:0]
+
+        for leaf in self.leaves():
+            items.extend(leaf)
+
+        return items
+
+    # -------------------------------
+    # 'modification'
+
+    def set(self, index, item):
+        ''' Return a new vector whose item at the index is replaced. '''
+        index = self.to_position(index)
+        vec = self.clone()
+
+        if index >= self.tail_offset():
+            vec.tail = self.tail[:]
+            vec.tail[index & MASK] = item
+        else:
+            vec.root = set_path(self.root, self.shift, index, item)
+
+        return vec
+
+    def append(self, item):
+        ''' Return a new vector with the item added at the end. '''
+        return self.extend((item,))
+
+    def extend(self, items):
+        ''' Return a new vector with the items added at the end. '''
+        vec = self.clone()
+        vec.tail = self.tail[:]
+
+        for item in items:
+            if len(vec.tail) == WIDTH:
+                vec.push_tail()
+
+            vec.tail.append(item)
+            vec.count += 1
+
+        return vec
+
+    # -------------------------------
+    # internals
+
+    def clone(self):
+        vec = PVector.__new__(PVector)
+        vec.count, vec.shift, vec.root, vec.tail = \
+                self.count, self.shift, self.root, self.tail
+        return vec
+
+    def to_position(self, index):
+        ''' Return the index made positive, or raise IndexError. '''
+        if index < 0:
+            index += self.count
+
+        if not 0 <= index < self.count:
+            raise IndexError('vector index out of range')
+
+        return index
+
+    def tail_offset(self):
+        return self.count - len(self.tail)
+
+    def leaf_of(self, index):
+        if index >= self.tail_offset():
+            return self.tail
+
+        node = self.root
+        level = self.shift
+
+        while level > 0:
+            node = node[(index >> level) & MASK]
+            level -= BITS
+
+        return node
+
+    def leaves(self):
+        ''' Iterate over the leaves in order, the tail last. '''
+        for i in xrange(0, self.tail_offset(), WIDTH):
+            yield self.leaf_of(i)
+
+        yield self.tail
+
+    def push_tail(self):
+        ''' Move the full tail into the trie. (only for a vector which
+        is being built, i.e. not shared yet)
+        '''
+        num_trie = self.tail_offset()
+
+        if (num_trie >> BITS) >= (1 << self.shift):
+            # root is full -> add a level
+            self.root = [self.root, new_path(self.shift, self.tail)]
+            self.shift += BITS
+        else:
+            self.root = push_leaf(self.root, self.shift, num_trie,
+                                  self.tail)
+
+        self.tail = self.tail[:0]
+
+# -----------------------------------------------------------
+
+class PRange(object):
+    ''' Arithmetic sequence start, start + diff, ... (count items) made
+    by make(int) on access. Supports the same operations as PVector.
+    '''
+    __slots__ = ('start', 'diff', 'count', 'make')
+
+    def __init__(self, start, end, diff, make):
+        if diff > 0:
+            count = (end - start + diff - 1) // diff
+        else:
+            count = (start - end - diff - 1) // -diff
+
+        self.start, self.diff, self.count, self.make = \
+                start, diff, max(count, 0), make
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return imap(self.make, xrange(self.start,
+                                      self.start + self.count * self.diff,
+                                      self.diff))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, end, diff = index.indices(self.count)
+            start = self.start + start * self.diff
+            end = self.start + end * self.diff
+            return PRange(start, end, diff * self.diff, self.make)
+
+        if index < 0:
+            index += self.count
+
+        if not 0 <= index < self.count:
+            raise IndexError('range index out of range')
+
+        return self.make(self.start + index * self.diff)
+
+    def __add__(self, other):
+        return self.to_vector().extend(other)
+
+    def __mul__(self, times):
+        return self.to_vector() * times
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def set(self, index, item):
+        return self.to_vector().set(index, item)
+
+    def append(self, item):
+        return self.to_vector().append(item)
+
+    def extend(self, items):
+        return self.to_vector().extend(items)
+
+    def to_vector(self):
+        return PVector(self)
+
+# -----------------------------------------------------------
+# path copying
+
+def set_path(node, level, index, item):
+    node = node[:]
+
+    if level == 0:
+        node[index & MASK] = item
+    else:
+        i = (index >> level) & MASK
+        node[i] = set_path(node[i], level - BITS, index, item)
+
+    return node
+
+def new_path(level, leaf):
+    ''' Return a node with the leaf at 'level' levels below. '''
+    while level > 0:
+        leaf = [leaf]
+        level -= BITS
+
+    return leaf
+
+def push_leaf(node, level, index, leaf):
+    ''' Return a copy of the node with the leaf put at the index. '''
+    node = list(node)
+    i = (index >> level) & MASK
+
+    if level == BITS:
+        node.append(leaf)
+    elif i < len(node):
+        node[i] = push_leaf(node[i], level - BITS, index, leaf)
+    else:
+        node.append(new_path(level - BITS, leaf))
+
+    return node
+
+# -----------------------------------------------------------
+
+def test():
+    print '[PVector test]'
+
+    for n in (0, 1, 32, 33, 1024, 1057, 40000):
+        items = range(n)
+        vec = PVector(items)
+        grown = PVector().extend(items)
+
+        assert list(vec) == items and list(grown) == items
+        assert [vec[i] for i in xrange(n)] == items
+        assert [grown[i] for i in xrange(n)] == items
+
+        if n:
+            changed = vec.set(n / 2, 'x').set(-1, 'y')
+            items_changed = list(items)
+            items_changed[n / 2], items_changed[-1] = 'x', 'y'
+
+            assert list(changed) == items_changed
+            assert list(vec) == items
+            assert list(vec[1:n:3]) == items[1:n:3]
+
+        assert list(vec + vec.append(-1)) == items + items + [-1]
+
+        # typed leaves
+        vec_typed = PVector(items, 'l')
+
+        if n:
+            changed = vec_typed.set(n / 2, -1).append(7)
+            items_changed = list(items)
+            items_changed[n / 2] = -1
+
+            assert list(changed) == items_changed + [7]
+            assert list(vec_typed) == items
+            assert list(vec_typed[::-2]) == items[::-2]
+
+        assert all(leaf.__class__ is array for leaf in
+                   (vec_typed * 2).append(0).leaves())
+        assert vec_typed.flatten() == array('l', items)
+        assert vec.flatten() == items
+
+        print '%5d items - ok' % n
+
+    for start, end, diff in ((0, 10, 1), (3, 40, 7), (10, -3, -2),
+                             (5, 5, 1), (5, 2, 1), (2, 5, -1)):
+        items = range(start, end, diff)
+        rng = PRange(start, end, diff, int)
+
+        assert list(rng) == items and len(rng) == len(items)
+        assert [rng[i] for i in xrange(-len(items), len(items))]\
+                == items + items
+
+        for sl in (slice(1, None, 2), slice(None, None, -1),
+                   slice(-3, 100, 3), slice(4, 1, 1)):
+            assert list(rng[sl]) == items[sl]
+
+        assert list(rng + rng) == items + items
+
+        print 'range(%d, %d, %d) - ok' % (start, end, diff)
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,183 @@
+''' Rope. (value of the large strings, and of the string builders)
+
+A persistent string made of chunks : a persistent vector of the chunks,
+and one of the offset of the end of each chunk. Appending to a rope
+returns a new rope in O(log32 n) time, without copying the string. A
+small piece is merged into the last chunk (up to CHUNK characters), so
+appending characters one by one doesn't make a chunk of each.
+
+An index is found by binary search on the ends, so get() takes O(log n)
+time, and a slice takes O(log n) + the length of the slice.
+'''
+
+from pvector import PVector
+
+# longest chunk made by merging
+CHUNK = 512
+
+class Rope(object):
+    ''' Persistent string of chunks. Supports len, indexing, slicing
+    and str().
+    '''
+    __slots__ = ('chunks', 'ends')
+
+    def __init__(self, chunks = ()):
+        chunks = [c for c in chunks if c]
+        ends, end = [], 0
+
+        for c in chunks:
+            end += len(c)
+            ends.append(end)
+
+        self.chunks, self.ends = PVector(chunks), PVector(ends)
+
+    def __len__(self):
+        if self.ends.count:
+            return self.ends[-1]
+        else:
+            return 0
+
+    def __str__(self):
+        return ''.join(self.chunks)
+
+    def __getitem__(self, index):
+        length = len(self)
+
+        if isinstance(index, slice):
+            start, end, diff = index.indices(length)
+
+            if diff == 1:
+                return self.substring(start, end)
+
+            indices = xrange(start, end, diff)
+
+            if not indices:
+                return ''
+
+            # (characters of the span, then every diff-th one of them)
+            low = min(indices[0], indices[-1])
+            span = self.substring(low, max(indices[0], indices[-1]) + 1)
+            return ''.join([span[i - low] for i in indices])
+
+        if index < 0:
+            index += length
+
+        if not 0 <= index < length:
+            raise IndexError('rope index out of range')
+
+        i = self.find_chunk(index)
+        return self.chunks[i][index - self.start_of(i)]
+
+    def __repr__(self):
+        return 'Rope(%r)' % str(self)
+
+    # -------------------------------
+    # 'modification'
+
+    def append(self, s):
+        ''' Return a new rope with the string added at the end. '''
+        if not s:
+            return self
+
+        chunks, ends = self.chunks, self.ends
+
+        if chunks.count and len(chunks[-1]) + len(s) <= CHUNK:
+            return make_rope(chunks.set(-1, chunks[-1] + s),
+                             ends.set(-1, ends[-1] + len(s)))
+        else:
+            return make_rope(chunks.append(s), ends.append(len(self) + len(s)))
+
+    def extend(self, other):
+        ''' Return a new rope with the other rope added at the end. '''
+        if other.chunks.count <= 1:
+            return self.append(str(other))
+
+        length = len(self)
+        return make_rope(self.chunks.extend(other.chunks),
+                         self.ends.extend([end + length
+                                           for end in other.ends]))
+
+    # -------------------------------
+    # internals
+
+    def find_chunk(self, index):
+        ''' Return the position of the chunk of the index. '''
+        ends = self.ends
+        low, high = 0, ends.count - 1
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if ends[middle] <= index:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def start_of(self, i):
+        if i:
+            return self.ends[i - 1]
+        else:
+            return 0
+
+    def substring(self, start, end):
+        if start >= end:
+            return ''
+
+        i = self.find_chunk(start)
+        offset = self.start_of(i)
+        pieces = []
+
+        while offset < end:
+            chunk = self.chunks[i]
+            pieces.append(chunk[max(start - offset, 0):end - offset])
+            offset += len(chunk)
+            i += 1
+
+        return ''.join(pieces)
+
+def make_rope(chunks, ends):
+    rope = Rope.__new__(Rope)
+    rope.chunks, rope.ends = chunks, ends
+    return rope
+
+# -----------------------------------------------------------
+
+def test():
+    import random
+
+    print '[Rope test]'
+
+    random.seed(1)
+
+    for n in (0, 1, 100, 3000):
+        rope, s = Rope(), ''
+
+        for i in xrange(n):
+            piece = 'abcdefghij'[:random.randint(0, 10)] * \
+                    random.choice((1, 1, 1, 80))
+
+            if random.random() < 0.1:
+                rope = rope.extend(Rope([piece, str(i)]))
+                s += piece + str(i)
+            else:
+                rope = rope.append(piece)
+                s += piece
+
+        assert len(rope) == len(s) and str(rope) == s
+
+        for i in xrange(200):
+            if s:
+                index = random.randint(-len(s), len(s) - 1)
+                assert rope[index] == s[index]
+
+            sl = slice(random.randint(-5, len(s) + 5),
+                       random.randint(-5, len(s) + 5),
+                       random.choice((None, 1, 2, 7, -1, -3)))
+            assert rope[sl] == s[sl], sl
+
+        print '%4d appends (%d chunks) - ok' % (n, rope.chunks.count)
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,164 @@
+''' Elementwise operations on vectors of numbers. (for the built-in
+functions 'vadd', 'vcmp_lnq', 'vdot', 'where', ...)
+
+A vector is an array.array of C longs ('l') or C doubles ('d'), and an
+operand may also be a number, which stands for a vector of that number.
+Each operation is one pass in C : with NumPy if it's importable, and
+with map() over the arrays otherwise.
+
+Both give the same results, except for the last bits of float sums
+(NumPy adds in pairs). NumPy's integers wrap around on overflow, so an
+operation on integers whose result might not fit in a C long runs in
+Python, where it gives OverflowError.
+'''
+
+import sys
+import operator
+from array import array
+from itertools import imap, izip, repeat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ops = {
+    'add' : operator.add, 'sub' : operator.sub, 'mul' : operator.mul,
+    'eq' : operator.eq, 'neq' : operator.ne, 'lnq' : operator.lt,
+    'leq' : operator.le, 'gnq' : operator.gt, 'geq' : operator.ge
+}
+
+# (give 0 / 1)
+ops_compare = ('eq', 'neq', 'lnq', 'leq', 'gnq', 'geq')
+
+def binary(name, a, b, typecode):
+    ''' Return the array (of the typecode) of the operation applied to
+    the items of the operands.
+    '''
+    if name in ops_compare:
+        if use_numpy(a, b):
+            return from_numpy(ops[name](to_numpy(a), to_numpy(b)), 'l')
+    elif use_numpy(a, b) and (typecode == 'd' or
+                              fits(name, max_abs(a), max_abs(b))):
+        return from_numpy(ops[name](to_numpy(a), to_numpy(b)), typecode)
+
+    return array(typecode, imap(ops[name], to_iter(a), to_iter(b)))
+
+def total(a, typecode):
+    ''' Return the sum of the items. '''
+    if use_numpy(a) and (typecode == 'd' or
+                         fits('mul', max_abs(a), len(a))):
+        return to_number(numpy.sum(to_numpy(a)), typecode)
+
+    return sum(a)
+
+def dot(a, b, typecode):
+    ''' Return the sum of the products of the items. '''
+    if use_numpy(a, b) and (typecode == 'd' or
+                            fits('mul', max_abs(a) * max_abs(b), len(a))):
+        return to_number(numpy.dot(to_numpy(a), to_numpy(b)), typecode)
+
+    return sum(imap(operator.mul, a, b))
+
+def where(cond, a, b, typecode):
+    ''' Return the array of the items of 'a' where the item of 'cond' is
+    nonzero, and of 'b' elsewhere.
+    '''
+    if use_numpy(cond, a, b):
+        return from_numpy(numpy.where(to_numpy(cond) != 0, to_numpy(a),
+                                      to_numpy(b)), typecode)
+
+    return array(typecode, (x if c else y for c, x, y in
+                            izip(cond, to_iter(a), to_iter(b))))
+
+# -----------------------------------------------------------
+
+def use_numpy(*operands):
+    # (a Python long out of int64 would make NumPy use objects)
+    return numpy is not None and \
+            all(x.__class__ in (array, float) or
+                -sys.maxint - 1 <= x <= sys.maxint for x in operands)
+
+def fits(name, m, n):
+    ''' Return whether the result of the operation on the integers whose
+    absolute values are at most 'm' and 'n' fits in a C long.
+    '''
+    if name == 'mul':
+        return m * n <= sys.maxint
+    else:
+        return m + n <= sys.maxint
+
+def max_abs(x):
+    ''' Return the biggest absolute value of the items (of a number, the
+    number itself).
+    '''
+    if x.__class__ is not array:
+        return abs(x)
+    elif not x:
+        return 0
+
+    values = to_numpy(x)
+    return max(abs(int(values.min())), abs(int(values.max())))
+
+def to_iter(x):
+    if x.__class__ is array:
+        return x
+    else:
+        return repeat(x)
+
+def to_numpy(x):
+    if x.__class__ is array:
+        # (no copy)
+        return numpy.frombuffer(x, numpy.dtype(x.typecode))
+    else:
+        return x
+
+def from_numpy(values, typecode):
+    return array(typecode, values.astype(typecode).tostring())
+
+def to_number(value, typecode):
+    if typecode == 'd':
+        return float(value)
+    else:
+        return int(value)
+
+# -----------------------------------------------------------
+
+def test():
+    global numpy
+
+    print '[Vector test] (NumPy : %s)' % ('yes' if numpy else 'no')
+
+    a, b = array('l', [3, -1, 4, 0]), array('d', [0.5, -1.0, 4.0, 2.0])
+    big = array('l', [sys.maxint, 1])
+
+    def results():
+        r = [binary(name, a, x, tc) for name in sorted(ops)
+             for x, tc in ((a, 'l'), (b, 'd'), (2, 'l'), (-1.5, 'd'))]
+        r += [total(a, 'l'), total(b, 'd'), dot(a, a, 'l'), dot(a, b, 'd'),
+              where(a, b, 7, 'd'), where(b, a, 7, 'l'),
+              binary('lnq', a, 10 ** 30, 'l'), total(big, 'l')]
+
+        try:
+            binary('add', big, big, 'l')
+        except OverflowError:
+            r.append('overflow')
+
+        return r
+
+    r = results()
+    assert r[-1] == 'overflow' and r[-2] == sys.maxint + 1
+
+    if numpy is not None:
+        # the same results without NumPy
+        numpy, numpy_saved = None, numpy
+
+        try:
+            assert results() == r
+        finally:
+            numpy = numpy_saved
+
+    print '%d results - ok' % len(r)
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,971 @@
+''' Bytecode compiler and stack-based virtual machine.
+
+Alternative to the tree-walking engine (CodeObject.evaluate) and the
+closure compiler (codegen.py). Each code object is lowered into a flat
+list of instructions, and the machine runs them with an explicit stack
+of activations, so neither user-defined function calls nor 'if', 'for',
+'while', 'return', 'break' and 'continue' recurse through Python's
+stack.
+
+Remarks
+- The arguments of the built-in functions are evaluated by the machine
+  and passed as values (whose 'evaluate' returns themselves). This is
+  safe since every built-in function except the control ones above
+  evaluates each argument exactly once, from left to right.
+- The control functions are lowered into jumps, guarded by a check
+  that the name still refers to the built-in function (it can be
+  shadowed by 'let').
+- A call to a user-defined function right before the end of the body
+  or 'return' replaces the current activation (tail call).
+- The activations share one stack of values (and of pending calls and
+  of loops), so a call allocates no new list.
+- 'return', 'break' and 'continue' unwind the activations of the
+  machine. Only when they leave the machine (ex. $(return ...) at the
+  top level, or inside a lazy list element evaluated by 'get') they
+  become interrupts, like in the other engines.
+'''
+
+import frame
+from object import FloatObject, StrObject, ListObject,\
+        NameObject, CodeObject, Quote, make_int, obj_false, types_range,\
+        iter_seq
+from exception import Exception_lookup, Exception_arg, Exception_type
+from interrupt import Interrupt_return, Interrupt_loop
+
+# opcodes
+(OP_CONST, OP_LOAD, OP_FAIL, OP_CALL, OP_CALL_BUILTIN, OP_CALL_DYN,
+ OP_ARG, OP_DISPATCH, OP_APPLY, OP_CONTROL, OP_GENERIC, OP_POP, OP_JUMP,
+ OP_JUMP_IF_FALSE, OP_RUN_IF, OP_RUN_IF_ELSE, OP_FOR_PREP, OP_FOR_NEXT,
+ OP_WHILE_PREP, OP_ENTER_LOOP, OP_EXIT_LOOP, OP_RUN_BODY, OP_RETURN,
+ OP_BREAK, OP_CONTINUE, OP_END) = range(26)
+
+names_op = ['CONST', 'LOAD', 'FAIL', 'CALL', 'CALL_BUILTIN', 'CALL_DYN',
+            'ARG', 'DISPATCH', 'APPLY', 'CONTROL', 'GENERIC', 'POP',
+            'JUMP', 'JUMP_IF_FALSE', 'RUN_IF', 'RUN_IF_ELSE', 'FOR_PREP',
+            'FOR_NEXT', 'WHILE_PREP', 'ENTER_LOOP', 'EXIT_LOOP',
+            'RUN_BODY', 'RETURN', 'BREAK', 'CONTINUE', 'END']
+
+# built-in functions lowered into jumps
+names_control = ('if', 'if_else', 'for', 'while', 'return', 'break',
+                 'continue')
+
+# kinds of activation
+ACT_EVAL = 0 # evaluation of a code object / list of codes
+ACT_FUNC = 1 # body of a user-defined function
+
+obj_zero = obj_false
+
+def compile_code(code):
+    ''' Bind a runner of the machine to the 'evaluate' (and 'execute')
+    of the code object and all of its children (so that the built-in functions
+    evaluating lazy lists also use the machine). Return the code object
+    itself.
+    '''
+    if not isinstance(code, CodeObject):
+        return code
+
+    op, arg = code.op, code.arg
+
+    if op == 'list':
+        for c in arg:
+            compile_code(c)
+    elif op == 'eval':
+        compile_code(arg)
+
+    # (the machine handles the signals itself, so a statement runs
+    # in the same way as an expression)
+    code.evaluate = code.execute = make_runner(code)
+    return code
+
+def make_runner(code):
+    chunk = []
+
+    def run():
+        if not chunk:
+            chunk.extend(lower_code(code))
+
+        return execute(chunk)
+
+    return run
+
+# -----------------------------------------------------------
+# compiler
+
+def lower_code(code):
+    ''' Return the instructions evaluating the code. '''
+    out = []
+    emit(code, out)
+    out.append((OP_END, None, None))
+    return out
+
+def lower_seq(codes):
+    ''' Return the instructions evaluating the codes in order
+    (-> value of the last code).
+    '''
+    out = []
+
+    if codes:
+        emit_seq(codes, out)
+    else:
+        out.append((OP_CONST, obj_zero, None))
+
+    out.append((OP_END, None, None))
+    return out
+
+def lower_body(func):
+    ''' Return the instructions of the user-defined function's body,
+    cached on the function object.
+    '''
+    try:
+        return func.chunk
+    except AttributeError:
+        func.chunk = lower_seq(func.codes)
+        return func.chunk
+
+def emit_seq(codes, out):
+    for c in codes[:-1]:
+        emit(c, out)
+        out.append((OP_POP, None, None))
+
+    emit(codes[-1], out)
+
+def emit(code, out):
+    ''' Append the instructions which push the value of the code. '''
+    if not isinstance(code, CodeObject):
+        out.append((OP_CONST, code, None))
+        return
+
+    op, arg = code.op, code.arg
+
+    if op == 'int':
+        out.append((OP_CONST, make_int(arg), None))
+    elif op == 'float':
+        out.append((OP_CONST, FloatObject(arg), None))
+    elif op == 'str':
+        out.append((OP_CONST, StrObject(arg), None))
+    elif op == 'list':
+        out.append((OP_CONST, ListObject(arg), None))
+    elif op == 'name':
+        out.append((OP_CONST, NameObject(arg), None))
+    elif op == 'eval':
+        if arg.op == 'name':
+            out.append((OP_LOAD, arg.arg, None))
+        elif arg.op == 'list':
+            if not arg.arg:
+                out.append((OP_FAIL, Exception_type,
+                            'Can\'t evaluate an empty list.'))
+                return
+
+            head, args = arg.arg[0], arg.arg[1:]
+
+            if isinstance(head, CodeObject) and head.op == 'name':
+                if head.arg in names_control:
+                    emit_control(head.arg, args, out)
+                else:
+                    emit_call(head.arg, args, out)
+            else:
+                # CALL_DYN jumps over the arguments if the function
+                # turns out to be a built-in one
+                emit(head, out)
+                i_call = len(out)
+                out.append(None)
+                emit_args(args, out)
+                out[i_call] = (OP_CALL_DYN, args, len(out))
+        else:
+            # $(else) -> return itself
+            emit(arg, out)
+    else:
+        out.append((OP_CONST, None, None))
+
+def emit_call(func_name, args, out):
+    func, num_params = frame.lookup_builtin(func_name)
+
+    if func is None or len(args) != num_params:
+        # (user-defined function, or the call is an error)
+        out.append((OP_CALL, func_name, len(args)))
+        emit_args(args, out)
+        return
+
+    # built-in function (resolved here) : its arguments are left on the
+    # stack, and APPLY calls it with them. While the name is bound to a
+    # variable, CALL_BUILTIN jumps to the user call instead, lowered at
+    # the end of the chunk when it's first needed.
+    i_call = len(out)
+    out.append(None)
+
+    for a in args:
+        emit(a, out)
+
+    # (indices of the arguments whose value may be a code object)
+    indices_eval = tuple(i for i in xrange(len(args))
+                         if isinstance(args[i], CodeObject) and
+                            args[i].op == 'eval')
+    out.append((OP_APPLY, len(args), (func, indices_eval)))
+    # [codes of the arguments, index after APPLY, index of the user call]
+    out[i_call] = (OP_CALL_BUILTIN, func_name, [args, len(out), None])
+
+def emit_args(args, out):
+    # (each argument is bound to the parameter once evaluated, in the
+    #  frame of the callee, like object.bind_args)
+    for i in xrange(len(args)):
+        emit(args[i], out)
+        out.append((OP_ARG, i, None))
+
+    out.append((OP_DISPATCH, None, None))
+
+def is_literal_list(code):
+    return isinstance(code, CodeObject) and code.op == 'list'
+
+def emit_control(func_name, args, out):
+    num_params = frame.lookup_builtin(func_name)[1]
+
+    if len(args) != num_params:
+        emit_call(func_name, args, out)
+        return
+
+    # CONTROL jumps to the generic call if the name is shadowed
+    i_control = len(out)
+    out.append(None)
+
+    if func_name == 'if':
+        emit_if(args, out)
+    elif func_name == 'if_else':
+        emit_if_else(args, out)
+    elif func_name == 'for':
+        emit_for(args, out)
+    elif func_name == 'while':
+        emit_while(args, out)
+    elif func_name == 'return':
+        emit(args[0], out)
+        out.append((OP_RETURN, None, None))
+    elif func_name == 'break':
+        out.append((OP_BREAK, None, None))
+    elif func_name == 'continue':
+        out.append((OP_CONTINUE, None, None))
+
+    i_jump = len(out)
+    out.append(None)
+    out[i_control] = (OP_CONTROL, func_name, len(out))
+    out.append((OP_GENERIC, (func_name, args), []))
+    out[i_jump] = (OP_JUMP, len(out), None)
+
+def emit_branch(codes, out):
+    if codes:
+        emit_seq(codes, out)
+    else:
+        out.append((OP_CONST, obj_zero, None))
+
+def emit_if(args, out):
+    cond, body = args
+    emit(cond, out)
+
+    if is_literal_list(body):
+        i_jump_false = len(out)
+        out.append(None)
+        emit_branch(body.arg, out)
+        i_jump = len(out)
+        out.append(None)
+        out[i_jump_false] = (OP_JUMP_IF_FALSE, len(out), None)
+        out.append((OP_CONST, obj_zero, None))
+        out[i_jump] = (OP_JUMP, len(out), None)
+    else:
+        emit(body, out)
+        out.append((OP_RUN_IF, None, None))
+
+def emit_if_else(args, out):
+    cond, body_true, body_false = args
+    emit(cond, out)
+
+    if is_literal_list(body_true) and is_literal_list(body_false):
+        i_jump_false = len(out)
+        out.append(None)
+        emit_branch(body_true.arg, out)
+        i_jump = len(out)
+        out.append(None)
+        out[i_jump_false] = (OP_JUMP_IF_FALSE, len(out), None)
+        emit_branch(body_false.arg, out)
+        out[i_jump] = (OP_JUMP, len(out), None)
+    else:
+        emit(body_true, out)
+        emit(body_false, out)
+        out.append((OP_RUN_IF_ELSE, None, None))
+
+def emit_loop_body(body, in_for, out):
+    if is_literal_list(body):
+        for c in body.arg:
+            emit(c, out)
+            out.append((OP_POP, None, None))
+    else:
+        out.append((OP_RUN_BODY, in_for, None))
+        out.append((OP_POP, None, None))
+
+def emit_for(args, out):
+    var_name, var_range, body = args
+    emit(var_name, out)
+    emit(var_range, out)
+
+    if is_literal_list(body):
+        out.append((OP_FOR_PREP, False, None))
+    else:
+        emit(body, out)
+        out.append((OP_FOR_PREP, True, None))
+
+    # stack : [..., state]
+    i_top = len(out)
+    out.append(None)
+    i_enter = len(out)
+    out.append(None)
+    emit_loop_body(body, True, out)
+    out.append((OP_EXIT_LOOP, None, None))
+    out.append((OP_JUMP, i_top, None))
+    i_break = len(out)
+    out.append((OP_POP, None, None))
+    i_done = len(out)
+    out.append((OP_CONST, obj_zero, None))
+    out[i_top] = (OP_FOR_NEXT, i_done, None)
+    out[i_enter] = (OP_ENTER_LOOP, i_break, i_top)
+
+def emit_while(args, out):
+    cond, body = args
+    dynamic = not is_literal_list(body)
+
+    if dynamic:
+        # the codes are evaluated (and checked) before the condition
+        emit(body, out)
+        out.append((OP_WHILE_PREP, None, None))
+
+    i_top = len(out)
+    emit(cond, out)
+    i_jump_false = len(out)
+    out.append(None)
+    i_enter = len(out)
+    out.append(None)
+    emit_loop_body(body, False, out)
+    out.append((OP_EXIT_LOOP, None, None))
+    out.append((OP_JUMP, i_top, None))
+    i_done = len(out)
+
+    if dynamic:
+        out.append((OP_POP, None, None))
+
+    out.append((OP_CONST, obj_zero, None))
+    out[i_jump_false] = (OP_JUMP_IF_FALSE, i_done, None)
+    out[i_enter] = (OP_ENTER_LOOP, i_done, i_top)
+
+# -----------------------------------------------------------
+# machine
+
+def to_boolean(obj):
+    return not (obj.type == 'int' and obj.value == 0)
+
+def begin_call(func, func_name, num_args):
+    ''' Check the user-defined function and wind a new frame. Return
+    the pending call record.
+    '''
+    if func.type != 'func':
+        raise Exception_type('Cannot call \'%s\'.' % func.type)
+
+    params = func.params
+    num_params = len(params)
+
+    if num_args != num_params:
+        raise Exception_arg('Function \'%s\' expected %d'\
+                            ' arguments, but it got %d.'\
+                            % (func_name, num_params, num_args))
+
+    frame.wind_frame(func.layout)
+
+    # (function, params)
+    return func, params
+
+def lookup_builtin(func_name, num_args):
+    func, num_params = frame.lookup_builtin(func_name)
+
+    if func is None:
+        raise Exception_lookup('Function \'%s\' doesn\'t exist.'\
+                               % func_name)
+
+    if num_args != num_params:
+        raise Exception_arg('Function \'%s\' expected %d'\
+                            ' arguments, but it got %d.'\
+                            % (func_name, num_params, num_args))
+
+    return func
+
+def check_list(obj, msg):
+    if obj.type != 'list':
+        raise Exception_type(msg % obj.type)
+
+    return obj
+
+def execute(chunk):
+    ''' Run the instructions, and return the value left on the stack.
+    '''
+    lookup_variable = frame.lookup_variable
+    assign_variable = frame.assign_variable
+    names_bound = frame.names_bound
+
+    # stacks of the values, of the pending user calls (function, params)
+    # and of the loops (break target, continue target, sizes of the two
+    # other stacks), shared by all the activations : each one uses the
+    # part above its bases (sizes of the stacks when it began)
+    stack, calls, handlers = [], [], []
+    # (chunk, pc, kind, bases) of the suspended activations
+    acts = []
+    pc, kind, bases = 0, ACT_EVAL, (0, 0, 0)
+
+    while 1:
+        # 'signal' : 'return', 'break' or 'continue' with 'value'
+        # ... (the opcodes run the most often are tested first)
+        while 1:
+            op, a, b = chunk[pc]
+            pc += 1
+
+            if op == OP_LOAD:
+                obj = lookup_variable(a)
+
+                if obj is None:
+                    raise Exception_lookup(
+                        'Failed to find the variable with the name'\
+                        ' \'%s\'.' % a)
+
+                stack.append(obj)
+
+            elif op == OP_CONST:
+                stack.append(a)
+
+            elif op == OP_CALL_BUILTIN:
+                if a in names_bound:
+                    func = lookup_variable(a)
+
+                    if func is not None:
+                        # (user call, see emit_call)
+                        calls.append(begin_call(func, a, len(b[0])))
+
+                        if b[2] is None:
+                            b[2] = len(chunk)
+                            emit_args(b[0], chunk)
+                            chunk.append((OP_JUMP, b[1], None))
+
+                        pc = b[2]
+
+            elif op == OP_APPLY:
+                if a:
+                    args = stack[-a:]
+                    del stack[-a:]
+
+                    for i in b[1]:
+                        if args[i].type == 'code':
+                            args[i] = Quote(args[i])
+                else:
+                    args = ()
+
+                try:
+                    obj = b[0](*args)
+                except Interrupt_return as e:
+                    signal, value = 'return', e.obj_return
+                    break
+                except Interrupt_loop as e:
+                    signal, value = e.status, None
+                    break
+
+                if obj is None:
+                    stack.append(obj_zero)
+                else:
+                    stack.append(obj)
+
+            elif op == OP_CONTROL:
+                if a in names_bound and lookup_variable(a) is not None:
+                    pc = b
+
+            elif op == OP_JUMP_IF_FALSE:
+                obj = stack.pop()
+
+                if obj.type == 'int' and obj.value == 0:
+                    pc = a
+
+            elif op == OP_POP:
+                stack.pop()
+
+            elif op == OP_JUMP:
+                pc = a
+
+            elif op == OP_ENTER_LOOP:
+                handlers.append((a, b, len(stack), len(calls)))
+
+            elif op == OP_EXIT_LOOP:
+                handlers.pop()
+
+            elif op == OP_FOR_NEXT:
+                state = stack[-1]
+
+                try:
+                    item = state[1].next()
+                except StopIteration:
+                    stack.pop()
+                    pc = a
+                else:
+                    assign_variable(state[0], item)
+
+            elif op == OP_CALL:
+                if a in names_bound:
+                    func = lookup_variable(a)
+                else:
+                    func = None
+
+                if func is None:
+                    # (the name isn't a built-in function taking b
+                    #  arguments either, see emit_call : raises the error)
+                    lookup_builtin(a, b)
+
+                calls.append(begin_call(func, a, b))
+
+            elif op == OP_ARG:
+                assign_variable(calls[-1][1][a], stack.pop())
+
+            elif op == OP_DISPATCH:
+                func = calls.pop()[0]
+
+                if func.memo is not None:
+                    # memoized -> the result may be known
+                    try:
+                        obj = func.memo.call_bound()
+                    except Interrupt_loop as e:
+                        frame.unwind_frame()
+                        signal, value = e.status, None
+                        break
+
+                    frame.unwind_frame()
+                    stack.append(obj)
+                    continue
+
+                if kind == ACT_FUNC and len(calls) == bases[1]:
+                    op_next = chunk[pc]
+
+                    if op_next[0] == OP_JUMP:
+                        op_next = chunk[op_next[1]]
+
+                    if op_next[0] == OP_END or op_next[0] == OP_RETURN:
+                        # tail call -> replace the current activation, and
+                        # merge its frame into the callee's one
+                        frame.collapse_frame()
+                        del stack[bases[0]:]
+                        del handlers[bases[2]:]
+                        chunk, pc = lower_body(func), 0
+                        continue
+
+                acts.append((chunk, pc, kind, bases))
+                chunk, pc, kind = lower_body(func), 0, ACT_FUNC
+                bases = (len(stack), len(calls), len(handlers))
+
+            elif op == OP_RETURN:
+                signal, value = 'return', stack.pop()
+                break
+
+            elif op == OP_END:
+                # (the value stays on the stack, for the activation below)
+                if kind == ACT_FUNC:
+                    frame.unwind_frame()
+
+                if not acts:
+                    return stack.pop()
+
+                chunk, pc, kind, bases = acts.pop()
+
+            elif op == OP_RUN_BODY:
+                # stack : [..., state of 'for'] or [..., codes of 'while']
+                if a:
+                    codes = stack[-1][2]
+                else:
+                    codes = stack[-1]
+
+                acts.append((chunk, pc, kind, bases))
+                chunk, pc, kind = codes, 0, ACT_EVAL
+                bases = (len(stack), len(calls), len(handlers))
+
+            elif op == OP_FOR_PREP:
+                if a:
+                    codes = stack.pop()
+
+                var_range = stack.pop()
+                var_name = stack.pop()
+
+                if var_name.type != 'name':
+                    raise Exception_type('First argument of \'for\''\
+                                         ' should be \'name\', not'\
+                                         ' \'%s\'.' % var_name.type)
+
+                if var_range.type not in types_range:
+                    raise Exception_type('Second argument of \'for\''\
+                                         ' should be \'list\' or'\
+                                         ' \'stream\', not \'%s\'.'\
+                                         % var_range.type)
+
+                if a:
+                    check_list(codes, 'Third argument of \'for\''\
+                               ' should be \'list\', not \'%s\'.')
+                    stack.append([var_name.value, iter_seq(var_range),
+                                  lower_seq(codes.value)])
+                else:
+                    stack.append([var_name.value, iter_seq(var_range),
+                                  None])
+
+            elif op == OP_WHILE_PREP:
+                codes = check_list(stack.pop(), 'Second argument of'\
+                                   ' \'while\' should be \'list\','\
+                                   ' not \'%s\'.')
+                stack.append(lower_seq(codes.value))
+
+            elif op == OP_RUN_IF or op == OP_RUN_IF_ELSE:
+                if op == OP_RUN_IF:
+                    codes = check_list(stack.pop(), 'Second argument of'\
+                                       ' \'if\' should be \'list\','\
+                                       ' not \'%s\'.')
+                    cond = stack.pop()
+
+                    if not to_boolean(cond):
+                        codes = None
+                else:
+                    codes_false = stack.pop()
+                    codes_true = stack.pop()
+                    cond = stack.pop()
+                    check_list(codes_true, 'Second argument of'\
+                               ' \'if_else\' should be \'list\','\
+                               ' not \'%s\'.')
+                    check_list(codes_false, 'Third argument of'\
+                               ' \'if_else\' should be \'list\','\
+                               ' not \'%s\'.')
+
+                    if to_boolean(cond):
+                        codes = codes_true
+                    else:
+                        codes = codes_false
+
+                if codes is None or not codes.value:
+                    stack.append(obj_zero)
+                else:
+                    acts.append((chunk, pc, kind, bases))
+                    chunk, pc, kind = lower_seq(codes.value), 0, ACT_EVAL
+                    bases = (len(stack), len(calls), len(handlers))
+
+            elif op == OP_BREAK:
+                signal, value = 'break', None
+                break
+
+            elif op == OP_CONTINUE:
+                signal, value = 'continue', None
+                break
+
+            elif op == OP_CALL_DYN:
+                func = stack.pop()
+
+                if func.type == 'name':
+                    func_name = func.value
+                    func = lookup_variable(func_name)
+                else:
+                    func_name = 'Unnamed'
+
+                if func is not None:
+                    calls.append(begin_call(func, func_name, len(a)))
+                    continue
+
+                # built-in function chosen at runtime -> it gets the
+                # codes, since it may be one of the control functions
+                func = lookup_builtin(func_name, len(a))
+
+                try:
+                    obj = func(*a)
+                except Interrupt_return as e:
+                    signal, value = 'return', e.obj_return
+                    break
+                except Interrupt_loop as e:
+                    signal, value = e.status, None
+                    break
+
+                if obj is None:
+                    stack.append(obj_zero)
+                else:
+                    stack.append(obj)
+
+                pc = b
+
+            elif op == OP_GENERIC:
+                # name of the control function is shadowed
+                if not b:
+                    out = []
+                    emit_call(a[0], a[1], out)
+                    out.append((OP_END, None, None))
+                    b.extend(out)
+
+                acts.append((chunk, pc, kind, bases))
+                chunk, pc, kind = b, 0, ACT_EVAL
+                bases = (len(stack), len(calls), len(handlers))
+
+            elif op == OP_FAIL:
+                raise a(b)
+
+        # unwind the activations until someone handles the signal
+        while 1:
+            if len(handlers) > bases[2]:
+                h = handlers.pop()
+
+                if signal == 'return':
+                    continue
+
+                del stack[h[2]:]
+                del calls[h[3]:]
+
+                if signal == 'break':
+                    pc = h[0]
+                else:
+                    pc = h[1]
+
+                break
+
+            del stack[bases[0]:]
+            del calls[bases[1]:]
+
+            if kind == ACT_FUNC and signal == 'return':
+                frame.unwind_frame()
+                chunk, pc, kind, bases = acts.pop()
+                stack.append(value)
+                break
+
+            # (like the other engines, 'break' or 'continue' leaving
+            #  a function doesn't unwind its frame)
+            if not acts:
+                if signal == 'return':
+                    raise Interrupt_return(value)
+                else:
+                    raise Interrupt_loop(signal)
+
+            chunk, pc, kind, bases = acts.pop()
+
+# -----------------------------------------------------------
+
+def dump(chunk):
+    ''' Print the instructions. '''
+    for i, (op, a, b) in enumerate(chunk):
+        if op == OP_CALL_DYN:
+            a = '(%d codes)' % len(a)
+        elif op == OP_GENERIC:
+            a, b = a[0], None
+        elif op == OP_CALL_BUILTIN:
+            b = b[2]
+        elif op == OP_APPLY:
+            b = None
+
+        args = ' '.join(str(x) for x in (a, b) if x is not None)
+        print '%4d %-14s %s' % (i, names_op[op], args)
+
+def test():
+    import glob
+    import os
+    import subprocess
+    import sys
+    import tempfile
+    import parser
+    import builtin
+
+    print '[VM test]'
+
+    builtin.load()
+
+    src = '$(let s 0)\n'\
+            '$(for i $(range 0 5 1) (\n'\
+            '    $(if $(eq $i 3) ($(continue)))\n'\
+            '    $(let s $(add $s $i))))\n'\
+            '$(print $s)'
+
+    print '\n1) Source code\n'
+    print src
+
+    print '\n2) Bytecode\n'
+    codes = parser.parse(src).arg.arg[1].arg
+
+    for c in codes:
+        dump(lower_code(c))
+        print
+
+    print '3) Result\n'
+    compile_code(parser.parse(src)).evaluate()
+    print
+
+    # 4) the same output on every engine (of 'python simple.py <file>')
+    print '\n4) Engines\n'
+
+    dir_src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    srcs = [open(path).read()
+            for path in sorted(glob.glob(dir_src + '/../examples/*.simple'))]
+
+    srcs += [
+        # tail calls (the caller's variables stay visible to the callee)
+        r"""$(let t $(func (n acc) ($(if $(eq $n 0) ($(return $acc)))
+                $(return $(t $(sub $n 1) $(add $acc $n))))))
+            $(let u $(func (n) ($(if $(eq $n 0) ($(return 'u')))
+                $(u $(sub $n 1)))))
+            $(let even $(func (n) ($(if $(eq $n 0) ($(return 1)))
+                $(return $(odd $(sub $n 1))))))
+            $(let odd $(func (n) ($(if $(eq $n 0) ($(return 0)))
+                $(return $(even $(sub $n 1))))))
+            $(print ($(t 100 0) $(u 100) $(even 51) $(odd 51)))""",
+        r"""$(let t $(func (n) ($(if $(eq $n 0) ($(return 't')))
+                $(return $(t $(sub $n 1))))))
+            $(let u $(func (n) ($(if $(eq $n 0) ($(return 'u')))
+                $(u $(sub $n 1)))))
+            $(let w $(func (n) ($(while 1 ($(if $(eq $n 0) ($(return 'w')))
+                $(return $(w $(sub $n 1))))))))
+            $(print ($(t 5000) $(u 5000) $(w 5000)))""",
+        # a frame left wound by 'break' out of a function isn't a call
+        r"""$(let p $(func () ($(print 'p-called'))))
+            $(let m $(func () ($(break))))
+            $(for i (1 2) ($(m)))
+            $(return $(p))""",
+        r"""$(let g $(func (a) ($(return $(add $a $loc)))))
+            $(let f $(func (n) ($(let loc 10) $(return $(g $n)))))
+            $(let f2 $(func (n) ($(let loc 20) $(g $n))))
+            $(let h $(func (x y) ($(return $(h2 $y $x)))))
+            $(let h2 $(func (y x) ($(return $(early ($x $y $loc))))))
+            $(let loc 5)
+            $(print ($(f 1) $(f2 1) $(h 1 2)))
+            $(let r $(func (n) ($(return $(r2 $(return 7))))))
+            $(let r2 $(func (q) ($(return 8))))
+            $(print $(r 1))""",
+        # return, break and continue inside loops and functions
+        r"""$(let s 0)
+            $(for i $(range 0 20 1) (
+                $(if $(eq $(mod $i 2) 0) ($(continue)))
+                $(if $(gnq $i 13) ($(break)))
+                $(let s $(add $s $i))))
+            $(let i 0)
+            $(while 1 ($(let i $(add $i 1)) $(if $(eq $i 5) ($(break)))))
+            $(print ($s $i))""",
+        r"""$(let f $(func (n) ($(for i (1 2 3 4 5) (
+                $(if $(eq $i $n) ($(return $(mul $i 10)))) $(print $i))) 99)))
+            $(print ($(f 3) $(f 9)))
+            $(let g $(func () ($(let i 0) $(while 1 ($(let i $(add $i 1))
+                $(if_else $(lnq $i 3) ($(continue))
+                    ($(if $(eq $i 6) ($(break))))) $(print $i))) $i)))
+            $(print $(g))
+            $(let h $(func () ($(print $(for i (1 2) ($(return 7)))) 8)))
+            $(let k $(func () ($(print $(if 1 ($(return 4)))) 8)))
+            $(let e $(func () ($(get ($(return 5)) 0) $(return 6))))
+            $(print ($(h) $(k) $(e)))
+            $(for i (1 2 3) ($(print $(if 1 ($(break)))) $(print 'no')))
+            $(let m $(func () ($(break))))
+            $(for i (1 2 3) ($(print $i) $(m) $(print 'no')))
+            $(let w $(func () ($(for z (1 2 3) (
+                $(let inner $(func () ($(continue))))
+                $(print $z) $(inner) $(print 'no'))) 'w')))
+            $(print $(w))
+            $(return 5)
+            $(print 'top')""",
+        r"""$(let b ($(print 'x') $(if $(eq $k 2) ($(break))) $(print $k)))
+            $(for k (1 2 3) $b)
+            $(let k 0)
+            $(let wb ($(let k $(add $k 1))))
+            $(while $(lnq $k 3) $wb)
+            $(let tb ($(print 'T')))
+            $(let fb ($(print 'F') 7))
+            $(print ($k $(if_else 0 $tb $fb) $(if_else 1 $tb ())
+                     $(if 1 $fb)))""",
+        # built-in functions calling back user-defined ones
+        r"""$(let sq $(func (x) ($(mul $x $x))))
+            $(let big $(func (x) ($(return $(gnq $x 3)))))
+            $(let m $(memo $sq 4))
+            $(print ($(to_list $(map $sq (1 2 3)))
+                     $(to_list $(filter $big (1 5 2 7)))
+                     $(fold add 0 (1 2 3)) $(to_list $(map neg (1 2)))
+                     $(sort_by $sq (3 -4 1)) $(m 3) $(m 3)
+                     $(memo_stats $m)))""",
+        r"""$(let inc $(func (x) ($(return $(add $x 1)))))
+            $(let f $(func (x) ($(return $(inc $x)))))
+            $(let odd $(func (x) ($(return $(mod2 $x)))))
+            $(let mod2 $(func (x) ($(mod $x 2))))
+            $(let plus $(func (a b) ($(return $(add2 $a $b)))))
+            $(let add2 $(func (a b) ($(add $a $b))))
+            $(let neg2 $(func (x) ($(return $(f $(neg $x))))))
+            $(print ($(to_list $(map $f (1 2 3)))
+                     $(to_list $(filter $odd (1 2 3 4 5)))
+                     $(fold $plus 0 (1 2 3)) $(sort_by $neg2 (1 3 2))))
+            $(let g $(func () ($(print $(to_list $(map $f (1 2 3))))
+                               $(print $(fold $plus 0 (1 2 3)))
+                               $(return 42))))
+            $(print $(g))""",
+        r"""$(let inc $(func (x) ($(return $(add $x 1)))))
+            $(let m $(memo $(func (x) ($(return $(inc $x)))) 10))
+            $(let h $(func (x) ($(return $(m $x)))))
+            $(print ($(m 1) $(m 2) $(h 1) $(h 3) $(memo_stats $m)))""",
+        # shadowed control functions
+        r"""$(let w while)
+            $(let i 0)
+            $($w $(lnq $i 3) ($(let i $(add $i 1)) $(print $i)))
+            $(let for $(func (a b c) ($(print 'myfor') $(return 3))))
+            $(print $(for 1 2 3))
+            $(let if 5)
+            $(print $(if_else 1 (1) (2)))
+            $(if 1 (2))""",
+        r"""$(let return $(func (x) ($(print 'myret ') $x)))
+            $(let g $(func (a) ($(add $a 1))))
+            $(let k $(func () ($(return $(g 1)) 3)))
+            $(print $(k))
+            $(let break $(func () ($(print 'mybreak'))))
+            $(for i (1 2) ($(break) $(print $i)))""",
+        # errors
+        r"""$(let f $(func (x) ($x)))
+            $(print $(f 1))
+            $(f 1 2)""",
+        r"""$(let f $(func (x) ($(return $(g $x)))))
+            $(let g $(func (x) ($(add $x 'a'))))
+            $(print $(f 1))""",
+        r"""$(let f $(func (x) ($(return $(g $x)))))
+            $(let g 3)
+            $(print $(f 1))"""
+    ]
+
+    # sources typed into the REPL (line by line)
+    srcs_repl = [
+        # a frame left wound by an error isn't a call of a function
+        r"""$(let p $(func () ($(print 'p-called'))))
+            $(let f $(func () ($(add 1 'a'))))
+            $(f)
+            $(return $(p))
+            $(exit 0)"""
+    ]
+
+    def result(engine, path, src_input):
+        p = subprocess.Popen([sys.executable, dir_src + '/simple.py',
+                              '--engine=' + engine, '--no-cache'] + path,
+                             stdin = subprocess.PIPE,
+                             stdout = subprocess.PIPE,
+                             stderr = subprocess.STDOUT)
+        return p.communicate(src_input)[0]
+
+    num_fail = 0
+
+    for src in srcs + srcs_repl:
+        if src in srcs_repl:
+            lines = ''.join(line.strip() + '\n'
+                            for line in src.split('\n'))
+            results = [result(engine, [], lines)
+                       for engine in ('tree', 'closure', 'vm')]
+        else:
+            fd, path = tempfile.mkstemp('.simple')
+
+            try:
+                os.write(fd, src)
+                os.close(fd)
+
+                results = [result(engine, [path], '30\n')
+                           for engine in ('tree', 'closure', 'vm')]
+            finally:
+                os.remove(path)
+
+        if results[1] != results[0] or results[2] != results[0]:
+            print 'Differs :', repr(src[:60])
+            num_fail += 1
+
+    print '%d sources, %d differ' % (len(srcs + srcs_repl), num_fail)
+
+if __name__ == '__main__':
+    test()
@@ -1,9 +1,22 @@
 from __future__ import with_statement
 import sys
 from lib import parser
+from lib import codecache
+from lib import optimizer
 from lib import builtin
+from lib import codegen
+from lib import vm
 from lib.exception import Exception_base
 
+# execution engines
+# ... Each one prepares the parsed code object for 'evaluate'.
+# ... 'tree' is the reference one (walks the code objects directly).
+map_engine = {
+    'tree' : lambda code: code,
+    'closure' : codegen.compile_code,
+    'vm' : vm.compile_code
+}
+
 def print_string(s):
     sys.stdout.write(s)
     sys.stdout.flush()
@@ -11,22 +24,39 @@ def print_string(s):
 def read_string():
     return sys.stdin.readline()[:-1]
 
-def run_file(src):
+def run_file(path, engine, use_cache, stream, optimize):
     try:
-        with open(sys.argv[1], 'r') as p:
-            src = p.read()
+        p = open(path, 'r')
     except IOError:
         print_string('[Error-IO] That file doesn\'t exist!\n')
         sys.exit(1)
     
     try:
-        parser.parse(src).evaluate()
+        with p:
+            if stream:
+                # parse and run the top-level codes one by one
+                builtin.run_main(engine(code)
+                                 for code in parser.parse_file(p))
+                return
+
+            src = p.read()
+
+        if use_cache:
+            code = codecache.parse(src, path)
+        else:
+            code = parser.parse(src)
+
+        if optimize:
+            # (needs the whole program, so not in the streaming mode)
+            code = optimizer.optimize(code)
+
+        engine(code).evaluate()
     except Exception_base as e:
         print_string('[%s] %s\n' % (e.name, str(e)))
     except KeyboardInterrupt:
         print_string('\nAborted by user.\n')
 
-def run_repl():
+def run_repl(engine):
     print_string('SimpleLang REPL (platform : %s)\n' % sys.platform)
 
     while 1:
@@ -35,7 +65,7 @@ def run_repl():
             src = read_string()
 
             builtin.called_main = False
-            parser.parse(src).evaluate()
+            engine(parser.parse(src)).evaluate()
 
             if builtin.called_print:
                 print_string('\n')
@@ -48,8 +78,34 @@ def run_repl():
 
 if __name__ == '__main__':
     args = sys.argv[1:]
+    name_engine = 'closure'
+    use_cache = True
+    stream = False
+    optimize = True
+
+    for a in args[:]:
+        if a.startswith('--engine='):
+            name_engine = a[len('--engine='):]
+            args.remove(a)
+        elif a == '--no-cache':
+            use_cache = False
+            args.remove(a)
+        elif a == '--stream':
+            stream = True
+            args.remove(a)
+        elif a == '--no-optimize':
+            optimize = False
+            args.remove(a)
+
+    if name_engine not in map_engine:
+        print_string('[Error-engine] Unknown engine \'%s\' (choose one'\
+                     ' of %s).\n' % (name_engine,
+                                     ', '.join(sorted(map_engine))))
+        sys.exit(1)
+
+    engine = map_engine[name_engine]
 
     if args:
-        run_file(args[0])
+        run_file(args[0], engine, use_cache, stream, optimize)
     else:
-        run_repl()
+        run_repl(engine)